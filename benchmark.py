@@ -0,0 +1,118 @@
+"""Throughput benchmark for the METAR cleaner
+
+Generates an Ogimet-style response (HTML wrapper, timestamped METAR/SPECI
+lines, comments and noise), checks that server.py's cleaner gives exactly
+the same output as the previous line-by-line implementation, and reports
+lines/sec and MB/sec for both, then times decoding the cleaned reports
+into columns.
+
+Usage: python benchmark.py [--lines 200000] [--repeat 5]
+"""
+import argparse
+import random
+import re
+import time
+
+from server import decode_metar_month, downloader
+
+
+def legacy_clean_metar(text):
+    """The cleaner as it was before the single-pass rewrite (reference output)"""
+    lines = text.split('\n')
+    clean_reports = []
+
+    for line in lines:
+        line = line.strip()
+
+        if not line:
+            continue
+
+        if line.startswith(('<', '#', '<!--')):
+            continue
+
+        if 'METAR' in line or 'SPECI' in line:
+            if re.match(r'^\d{10,14}\s+', line):
+                line = re.sub(r'^\d{10,14}\s+', '', line)
+            elif '->' in line:
+                line = line.split('->', 1)[1].strip()
+
+            line = ' '.join(line.split())
+
+            if len(line) > 20 and re.search(r'\d{6}Z', line):
+                clean_reports.append(line)
+
+    def get_time(report):
+        match = re.search(r'(\d{6})Z', report)
+        return match.group(1) if match else '000000'
+
+    clean_reports.sort(key=get_time)
+
+    return '\n'.join(clean_reports)
+
+
+def make_corpus(n_lines, seed=1):
+    """Ogimet-style text response with roughly n_lines report lines"""
+    rng = random.Random(seed)
+    stations = ['VOGA', 'VOMM', 'VABB', 'VIDP']
+    out = ['<html><head><title>Ogimet</title></head><body>', '<pre>',
+           '# METAR/SPECI from Ogimet', '']
+    minute = 0
+    for _ in range(n_lines):
+        minute += rng.choice([30, 30, 30, 17])
+        day, rest = divmod(minute // 60, 24)
+        day = day % 28 + 1
+        stamp = f"2024{(minute // 40320) % 12 + 1:02d}{day:02d}{rest:02d}{minute % 60:02d}"
+        station = rng.choice(stations)
+        kind = 'SPECI' if rng.random() < 0.05 else 'METAR'
+        wind = f"{rng.randrange(0, 360, 10):03d}{rng.randrange(0, 25):02d}KT"
+        report = (f"{kind} {station} {day:02d}{rest:02d}{minute % 60:02d}Z {wind} "
+                  f"{rng.choice(['9999', '6000', '3000', 'CAVOK'])} "
+                  f"{rng.choice(['FEW020', 'SCT025 BKN100', 'NSC', 'FEW015CB SCT020'])} "
+                  f"{rng.randrange(18, 35):02d}/{rng.randrange(10, 26):02d} Q{rng.randrange(1000, 1016)} NOSIG=")
+        roll = rng.random()
+        if roll < 0.02:
+            out.append(f"# {stamp} no data")
+        elif roll < 0.04:
+            out.append(f"   {stamp}  {report.replace(' ', '   ', 3)}   ")
+        else:
+            out.append(f"{stamp} {report}")
+    out += ['</pre>', '</body></html>']
+    return '\n'.join(out)
+
+
+def measure(clean, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        clean(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=200000, help='report lines in the corpus')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per cleaner (best is kept)')
+    args = parser.parse_args()
+
+    text = make_corpus(args.lines)
+    n_lines = text.count('\n') + 1
+    megabytes = len(text.encode('utf-8')) / 1e6
+
+    if downloader.clean_metar_text_original(text) != legacy_clean_metar(text):
+        raise SystemExit("❌ Output differs from the legacy cleaner")
+    print(f"✅ Output identical to the legacy cleaner ({n_lines:,} lines, {megabytes:.1f} MB)")
+
+    for name, clean in (('legacy', legacy_clean_metar), ('single-pass', downloader.clean_metar_text_original)):
+        elapsed = measure(clean, text, args.repeat)
+        print(f"{name:>12}: {n_lines / elapsed:>12,.0f} lines/s {megabytes / elapsed:>8.1f} MB/s ({elapsed * 1000:.1f} ms)")
+
+    clean = downloader.clean_metar_text_original(text)
+    n_reports = clean.count('\n') + 1
+    elapsed = measure(lambda data: decode_metar_month(data, '2024', '01'), clean, args.repeat)
+    print(f"{'decode':>12}: {n_reports / elapsed:>12,.0f} reports/s ({elapsed * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
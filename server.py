@@ -5,13 +5,2510 @@ import requests
 import re
 import time
 import os
-from datetime import datetime
+import json
+import hashlib
+import email.utils
+import zipfile
+import mmap
+import codecs
+import contextlib
+import itertools
+import uuid
+import queue
+import random
+import threading
+from array import array
+from bisect import bisect_left
+from calendar import timegm
+from collections import OrderedDict, deque
+from operator import itemgetter
+from concurrent.futures import Future
+from datetime import datetime, timedelta
 
 PORT = int(os.environ.get('PORT', 8080))
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 16))  # concurrent requests being served
+MAX_QUEUE = int(os.environ.get('MAX_QUEUE', 64))  # accepted requests waiting for a worker
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))  # batch jobs downloading at once
+JOB_TTL = int(os.environ.get('JOB_TTL', 6 * 3600))  # seconds a finished job stays visible
+EVENT_STREAM_SECONDS = int(os.environ.get('EVENT_STREAM_SECONDS', 45))  # before a progress stream asks the client to reconnect
+CACHE_DIR = os.environ.get('CACHE_DIR', 'cache')  # on-disk cache of cleaned upstream data
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 1800))  # seconds the current month stays fresh
+MEMORY_CACHE_BYTES = int(os.environ.get('MEMORY_CACHE_BYTES', 64 * 1024 * 1024))  # hot cleaned data
+ZIP_CACHE_DIR = os.environ.get('ZIP_CACHE_DIR', os.path.join(CACHE_DIR, 'zips'))  # finished folder archives
+PAGE_CACHE_BYTES = int(os.environ.get('PAGE_CACHE_BYTES', 16 * 1024 * 1024))  # rendered result pages
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 8))  # keep-alive connections to Ogimet
+COOKIE_TTL = int(os.environ.get('COOKIE_TTL', 1800))  # seconds before Ogimet cookies are re-primed
+UPSTREAM_RATE = float(os.environ.get('UPSTREAM_RATE', 0.25))  # upstream requests per second, all threads
+UPSTREAM_BURST = int(os.environ.get('UPSTREAM_BURST', 2))  # requests allowed back to back
+RANGE_MONTHS = int(os.environ.get('RANGE_MONTHS', 12))  # widest window asked for in one request (1 = off)
+MONTH_CONCURRENCY = int(os.environ.get('MONTH_CONCURRENCY', 4))  # months of one batch fetched at once
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', 4))  # station-months of a bulk job fetched at once
+BULK_MAX_MONTHS = int(os.environ.get('BULK_MAX_MONTHS', 6000))  # largest stations x months a bulk job may ask for
+UPSTREAM_MIN_RATE = float(os.environ.get('UPSTREAM_MIN_RATE', 0.02))  # floor while upstream pushes back
+NEGATIVE_TTL = int(os.environ.get('NEGATIVE_TTL', 7 * 24 * 3600))  # seconds a closed month/station stays known-empty
+QUERY_MAX_MONTHS = int(os.environ.get('QUERY_MAX_MONTHS', 120))  # widest span one /query may cover
+INDEX_CACHE_BYTES = int(os.environ.get('INDEX_CACHE_BYTES', 64 * 1024 * 1024))  # per-month time indexes
+DELTA_OVERLAP = int(os.environ.get('DELTA_OVERLAP', 60))  # minutes re-asked before the newest stored report
+WATCHLIST = os.environ.get('WATCHLIST', '')  # comma-separated stations kept warm in the background
+WATCH_TYPES = os.environ.get('WATCH_TYPES', 'METAR')  # comma-separated report types for the watchlist
+WATCH_INTERVAL = int(os.environ.get('WATCH_INTERVAL', 900))  # seconds between watchlist refresh rounds
+WATCH_QUIET = int(os.environ.get('WATCH_QUIET', 30))  # seconds without user requests before prefetching
+WATCH_PAUSE = float(os.environ.get('WATCH_PAUSE', 5))  # seconds between background fetches
+RETRY_BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', 1))  # first backoff ceiling in seconds (doubles per retry)
+RETRY_MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', 30))  # largest backoff ceiling in seconds
+RETRY_BUDGET = float(os.environ.get('RETRY_BUDGET', 0.2))  # retries allowed per first attempt, all threads
+RETRY_RESERVE = int(os.environ.get('RETRY_RESERVE', 10))  # retries that may be spent before the budget refills
+THROTTLE_BASE_DELAY = float(os.environ.get('THROTTLE_BASE_DELAY', 15))  # first backoff ceiling after a quota page
+CIRCUIT_FAILURES = int(os.environ.get('CIRCUIT_FAILURES', 5))  # consecutive upstream failures that open the circuit
+CIRCUIT_RESET = float(os.environ.get('CIRCUIT_RESET', 30))  # seconds the circuit stays open before probing
+CIRCUIT_PROBES = int(os.environ.get('CIRCUIT_PROBES', 1))  # requests let through while half-open
+DEBUG_DUMPS = os.environ.get('DEBUG_DUMPS', 'off')  # off, sampled or on-error: when to keep raw responses
+DEBUG_SAMPLE_RATE = float(os.environ.get('DEBUG_SAMPLE_RATE', 0.01))  # share of responses kept when sampled
+DEBUG_DIR = os.environ.get('DEBUG_DIR', 'debug')  # where debug dumps are written
+DEBUG_DIR_BYTES = int(os.environ.get('DEBUG_DIR_BYTES', 50 * 1024 * 1024))  # oldest dumps are deleted past this
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(CACHE_DIR, 'archive'))  # decoded METAR columns per station
+
+MONTH_NAMES = {
+    '01': 'January', '02': 'February', '03': 'March', '04': 'April',
+    '05': 'May', '06': 'June', '07': 'July', '08': 'August',
+    '09': 'September', '10': 'October', '11': 'November', '12': 'December'
+}
+
+# 12-digit Ogimet timestamp (YYYYMMDDHHMM) that starts every report line
+MONTH_PREFIX_RE = re.compile(r'^(\d{4})(\d{2})\d{6}\s')
+# Cleaner patterns, compiled once instead of per line
+METAR_TIMESTAMP_RE = re.compile(r'\d{10,14}\s+')
+REPORT_TIME_RE = re.compile(r'(\d{6})Z')
+TAF_START_RE = re.compile(r'^\d{12}\s+(TAF|TAF\s+AMD|TAF\s+COR)')
+TAF_TIMESTAMP_RE = re.compile(r'^\d{12}\s+')
+# METAR group patterns for the decoder (matched against whole tokens)
+WIND_RE = re.compile(r'(\d{3}|VRB)(\d{2,3})(?:G(\d{2,3}))?(KT|MPS|KMH)')
+WIND_UNIT_KNOTS = {'KT': 1, 'MPS': 1.94384, 'KMH': 1 / 1.852}
+VISIBILITY_RE = re.compile(r'(\d{4})(?:NDV)?')
+VISIBILITY_SM_RE = re.compile(r'[PM]?(?:(\d+) )?(\d+)(?:/(\d+))?SM')
+WEATHER_RE = re.compile(r'(?:[-+]|VC)?(?:MI|BC|PR|DR|BL|SH|TS|FZ)?'
+                        r'(?:DZ|RA|SN|SG|IC|PL|GR|GS|UP|BR|FG|FU|VA|DU|SA|HZ|PY|PO|SQ|FC|SS|DS)*')
+CLOUD_RE = re.compile(r'(FEW|SCT|BKN|OVC|VV)(\d{3}|///)(?:CB|TCU|///)?|NSC|SKC|CLR|NCD')
+TEMPERATURE_RE = re.compile(r'(M?\d{2})/(M?\d{2})?')
+PRESSURE_RE = re.compile(r'([QA])(\d{4})')
+
+# What a station, report type, year and month may look like - they end up in file paths
+STATION_RE = re.compile(r'[A-Z0-9]{4}')
+YEAR_RE = re.compile(r'[1-9]\d{3}')
+REPORT_TYPES = ('METAR', 'TAF')
+
+
+def check_target(station, report_type, year=None, month=None):
+    """Raise ValueError unless the values are safe to build cache paths from"""
+    if not isinstance(station, str) or not STATION_RE.fullmatch(station):
+        raise ValueError("station must be a 4-character ICAO code")
+    if report_type not in REPORT_TYPES:
+        raise ValueError("type must be METAR or TAF")
+    if year is not None and not (isinstance(year, str) and YEAR_RE.fullmatch(year)):
+        raise ValueError("year must be a four-digit year")
+    if month is not None and month not in MONTH_NAMES:
+        raise ValueError("month must be 01-12")
+
+
+def report_sort_key(report):
+    """ddhhmm the cleaners sort a report by ('000000' if it has none)"""
+    match = REPORT_TIME_RE.search(report.split('\n')[0])
+    return match.group(1) if match else '000000'
+
+
+def iter_response_lines(response, chunk_size=64 * 1024, read_time=None):
+    """Decode a streamed response and yield its lines as they arrive
+
+    Splits on '\\n' only, exactly like response.text.split('\\n'). Bytes
+    read are counted in the metrics; read_time, if given, is a one-item
+    list the seconds spent waiting for the network are added to.
+    """
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    pending = ''
+    chunks = response.iter_content(chunk_size)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        if read_time is not None:
+            read_time[0] += time.perf_counter() - start
+        if chunk is None:
+            break
+        metrics.inc('ogimet_upstream_bytes_total', len(chunk))
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        yield from lines
+    yield pending + decoder.decode(b'', final=True)
+
+
+def tag_lines_by_month(lines, head=None, tail=None):
+    """Yield ((year, month) or None, line), carrying the month of the last
+    timestamped line over to continuation lines. The first 200 lines are
+    also collected into head, if given, for error-page checks, and every
+    line is appended to tail (a bounded deque), if given.
+    """
+    current = None
+    for n, line in enumerate(lines):
+        if head is not None and n < 200:
+            head.append(line)
+        if tail is not None:
+            tail.append(line)
+        match = MONTH_PREFIX_RE.match(line)
+        if match:
+            current = match.groups()
+        yield current, line
+
+
+class ReportWriter:
+    """Write one month's cleaned reports to a temp file as they are recognized
+
+    The finished file matches the batch cleaners' output: reports joined by
+    newlines, stably sorted by ddhhmm. Upstream sends them in time order, so
+    the file only has to be re-sorted if a report arrives out of order.
+    commit() moves it into place; discard() throws it away.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(self.tmp_path, 'w', encoding='utf-8')
+        self.last_key = ''
+        self.in_order = True
+        self.count = 0
+
+    def write(self, key, report):
+        if key < self.last_key:
+            self.in_order = False
+        self.last_key = max(key, self.last_key)
+        if self.count:
+            self.file.write('\n')
+        self.file.write(report)
+        self.count += 1
+
+    def finish(self):
+        self.file.close()
+        if self.in_order:
+            return
+        with open(self.tmp_path, 'r', encoding='utf-8') as f:
+            reports = f.read().split('\n')
+        reports.sort(key=report_sort_key)
+        with open(self.tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(reports))
+
+    def commit(self):
+        """Move the finished file into place; returns the report count"""
+        os.replace(self.tmp_path, self.path)
+        return self.count
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+def month_end_day(year, month):
+    """Last day of the month as a 2-digit string (same leap rule as the downloads)"""
+    month_days = {
+        '01': '31', '02': '28', '03': '31', '04': '30',
+        '05': '31', '06': '30', '07': '31', '08': '31',
+        '09': '30', '10': '31', '11': '30', '12': '31'
+    }
+    if month == '02' and int(year) % 4 == 0:
+        return '29'
+    return month_days.get(month, '31')
+
+
+class MetarTable:
+    """Decoded METAR/SPECI reports stored column-wise
+
+    Numeric fields are typed array.array columns (contiguous, buffer
+    protocol - numpy.frombuffer can view them without a copy); weather and
+    cloud groups are lists of space-joined strings. Missing values are
+    MISSING, a variable wind direction is VARIABLE.
+    """
+    MISSING = -32768
+    VARIABLE = -1
+    NUMERIC = (
+        ('time', 'q'),          # observation time, seconds since the epoch (UTC)
+        ('speci', 'b'),         # 1 for SPECI, 0 for METAR
+        ('wind_dir', 'h'),      # degrees true
+        ('wind_speed', 'h'),    # knots
+        ('wind_gust', 'h'),     # knots
+        ('visibility', 'i'),    # metres (CAVOK = 10000)
+        ('ceiling', 'i'),       # feet, lowest BKN/OVC/VV layer
+        ('temperature', 'h'),   # degrees C
+        ('dewpoint', 'h'),      # degrees C
+        ('qnh', 'h'),           # hPa
+    )
+    TEXT = ('weather', 'clouds')
+
+    def __init__(self):
+        self.columns = {name: array(code) for name, code in self.NUMERIC}
+        for name in self.TEXT:
+            self.columns[name] = []
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def append(self, record):
+        """Add one row given in NUMERIC + TEXT order"""
+        for column, value in zip(self.columns.values(), record):
+            column.append(value)
+
+    def extend(self, other):
+        for name, column in self.columns.items():
+            column.extend(other.columns[name])
+
+    def to_json(self):
+        return {name: list(column) for name, column in self.columns.items()}
+
+
+def decode_metar(report, month_start, last_day):
+    """Decode one cleaned METAR/SPECI into a MetarTable row, or None if unreadable
+
+    month_start is the epoch time of the month's first midnight (UTC) and
+    last_day its number of days; reports only carry day/hour/minute.
+    """
+    missing = MetarTable.MISSING
+    tokens = report.replace('=', ' ').split()
+    if len(tokens) < 3 or tokens[0] not in ('METAR', 'SPECI'):
+        return None
+    i = 2 if tokens[1] != 'COR' else 3
+    stamp = tokens[i] if i < len(tokens) else ''
+    if len(stamp) != 7 or not stamp[:6].isdigit():
+        return None
+    day, hour, minute = int(stamp[:2]), int(stamp[2:4]), int(stamp[4:6])
+    if not (1 <= day <= last_day and hour < 24 and minute < 60):
+        return None
+    when = month_start + ((day - 1) * 24 + hour) * 3600 + minute * 60
+    
+    wind_dir = wind_speed = wind_gust = visibility = ceiling = missing
+    temperature = dewpoint = qnh = missing
+    weather = []
+    clouds = []
+    rest = tokens[i + 1:]
+    n = 0
+    while n < len(rest):
+        token = rest[n]
+        n += 1
+        if token in ('RMK', 'NOSIG', 'TEMPO', 'BECMG'):
+            break
+        if token in ('AUTO', 'COR', 'NIL') or token.startswith('R') and '/' in token:
+            continue
+        match = WIND_RE.fullmatch(token)
+        if match and wind_speed == missing:
+            direction, speed, gust, unit = match.groups()
+            factor = WIND_UNIT_KNOTS[unit]
+            wind_dir = MetarTable.VARIABLE if direction == 'VRB' else int(direction)
+            wind_speed = round(int(speed) * factor)
+            if gust:
+                wind_gust = round(int(gust) * factor)
+            continue
+        if visibility == missing:
+            if token == 'CAVOK':
+                visibility = 10000
+                continue
+            match = VISIBILITY_RE.fullmatch(token)
+            if match:
+                visibility = int(match.group(1))
+                continue
+            # US style, possibly split over two tokens: "1 1/2SM"
+            if token.isdigit() and n < len(rest) and rest[n].endswith('SM'):
+                token = f"{token} {rest[n]}"
+                n += 1
+            match = VISIBILITY_SM_RE.fullmatch(token)
+            if match:
+                whole, numerator, denominator = match.groups()
+                miles = int(whole or 0) + int(numerator) / int(denominator or 1)
+                visibility = round(miles * 1609.344)
+                continue
+        match = CLOUD_RE.fullmatch(token)
+        if match:
+            clouds.append(token)
+            cover, base = match.group(1), match.group(2)
+            if cover in ('BKN', 'OVC', 'VV') and base and base.isdigit() and ceiling == missing:
+                ceiling = int(base) * 100
+            continue
+        match = TEMPERATURE_RE.fullmatch(token)
+        if match:
+            temperature = int(match.group(1).replace('M', '-'))
+            if match.group(2):
+                dewpoint = int(match.group(2).replace('M', '-'))
+            continue
+        match = PRESSURE_RE.fullmatch(token)
+        if match:
+            value = int(match.group(2))
+            qnh = value if match.group(1) == 'Q' else round(value / 100 * 33.8639)
+            continue
+        if len(token) > 1 and token not in ('+', '-') and WEATHER_RE.fullmatch(token):
+            weather.append(token)
+    
+    return (when, int(tokens[0] == 'SPECI'), wind_dir, wind_speed, wind_gust, visibility, ceiling,
+            temperature, dewpoint, qnh, ' '.join(weather), ' '.join(clouds))
+
+
+def decode_metar_month(clean_data, year, month):
+    """Decode a month of cleaned METAR text (one report per line) into a MetarTable"""
+    table = MetarTable()
+    append = table.append
+    month_start = timegm((int(year), int(month), 1, 0, 0, 0))
+    last_day = int(month_end_day(year, month))
+    for report in clean_data.split('\n'):
+        record = decode_metar(report, month_start, last_day)
+        if record is not None:
+            append(record)
+    return table
+
+
+class ResponseCache:
+    """On-disk cache of cleaned Ogimet data keyed by station/type/year/month/end day
+
+    Closed months never change upstream, so an entry written after its month
+    settled (a day after it ends, while late reports trickle in) is kept
+    forever. Anything written earlier, even if the month has closed since,
+    expires after `ttl` seconds.
+    """
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    def path(self, station, report_type, year, month, end_day):
+        check_target(station, report_type, year, month)
+        return os.path.join(self.directory, report_type, station, f"{year}{month}_{end_day}.txt")
+
+    def settled_at(self, year, month):
+        """Epoch seconds from which upstream no longer changes the month"""
+        year, month = int(year), int(month)
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return timegm((next_year, next_month, 2, 0, 0, 0))
+
+    def is_closed(self, year, month):
+        return time.time() >= self.settled_at(year, month)
+
+    def mtime(self, station, report_type, year, month, end_day):
+        try:
+            return os.path.getmtime(self.path(station, report_type, year, month, end_day))
+        except OSError:
+            return None
+
+    def is_final(self, station, report_type, year, month, end_day):
+        """True if the entry was written after its month settled and will never change"""
+        mtime = self.mtime(station, report_type, year, month, end_day)
+        return mtime is not None and mtime >= self.settled_at(year, month)
+
+    def is_fresh(self, station, report_type, year, month, end_day):
+        """True if there is an entry that has not expired"""
+        mtime = self.mtime(station, report_type, year, month, end_day)
+        if mtime is None:
+            return False
+        return mtime >= self.settled_at(year, month) or time.time() - mtime <= self.ttl
+
+    def has(self, station, report_type, year, month, end_day):
+        """True if there is an entry, fresh or not"""
+        return os.path.exists(self.path(station, report_type, year, month, end_day))
+
+    def expires_within(self, station, report_type, year, month, end_day, seconds):
+        """True if the entry is missing or will be stale `seconds` from now"""
+        mtime = self.mtime(station, report_type, year, month, end_day)
+        if mtime is None:
+            return True
+        return mtime < self.settled_at(year, month) and time.time() - mtime + seconds > self.ttl
+
+    def get(self, station, report_type, year, month, end_day, stale_ok=False):
+        """Return cached clean data, or None on a miss or (unless stale_ok) a stale entry"""
+        if not stale_ok and not self.is_fresh(station, report_type, year, month, end_day):
+            return None
+        try:
+            with open(self.path(station, report_type, year, month, end_day), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, station, report_type, year, month, end_day, clean_data):
+        path = self.path(station, report_type, year, month, end_day)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so readers never see a half-written entry
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(clean_data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Cache write failed: {e}")
+
+
+class Metrics:
+    """Prometheus-style counters and histograms, rendered in the text exposition format
+
+    Metrics are declared once with counter()/histogram() and updated with
+    inc()/observe() and a label set given as keyword arguments.
+    """
+    TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self):
+        self.kinds = {}  # name -> (type, help, buckets)
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [per-bucket counts..., +Inf count, sum, count]
+        self.lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        self.kinds[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets=TIME_BUCKETS):
+        self.kinds[name] = ('histogram', help_text, buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self.kinds[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            series = self.histograms.get(key)
+            if series is None:
+                # One count per bucket, one for +Inf, then sum and count
+                series = self.histograms[key] = [0] * (len(buckets) + 3)
+            series[bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observe how long the with-block took, in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def escape_label(value):
+        """Label value quoted per the text exposition format"""
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def format_labels(self, labels, extra=()):
+        pairs = [*labels, *extra]
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{self.escape_label(v)}"' for k, v in pairs) + '}'
+
+    def render(self, gauges=(), totals=()):
+        """Exposition text; gauges and totals (counters kept elsewhere) are
+        (name, help, [(labels dict, value), ...]) computed by the caller"""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(series) for key, series in self.histograms.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in self.kinds.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                for (series_name, labels), value in counters.items():
+                    if series_name == name:
+                        lines.append(f"{name}{self.format_labels(labels)} {value}")
+                continue
+            for (series_name, labels), series in histograms.items():
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip((*buckets, '+Inf'), series):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self.format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{self.format_labels(labels)} {series[-2]}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {series[-1]}")
+        for kind, collected in (('gauge', gauges), ('counter', totals)):
+            for name, help_text, samples in collected:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{self.format_labels(sorted(labels.items()))} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+class NegativeCache:
+    """Remembers months upstream confirmed to have no reports, and unknown stations
+
+    Each entry is an empty marker file whose age is checked against its
+    own TTL: `ttl` for stations and for months marked after they settled,
+    `open_ttl` for months marked while they could still get reports.
+    """
+    def __init__(self, directory=os.path.join(CACHE_DIR, 'empty'), ttl=NEGATIVE_TTL, open_ttl=CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.open_ttl = open_ttl
+
+    def month_path(self, station, report_type, year, month):
+        check_target(station, report_type, year, month)
+        return os.path.join(self.directory, report_type, station, f"{year}{month}")
+
+    def station_path(self, station):
+        check_target(station, 'METAR')
+        return os.path.join(self.directory, 'unknown', station)
+
+    def mark(self, path):
+        """Create the marker, or bump its mtime - never truncating an existing file"""
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o644))
+            os.utime(path)
+        except OSError as e:
+            print(f"⚠️ Negative cache write failed: {e}")
+
+    def younger_than(self, path, ttl, settled_at=None):
+        """True if the marker exists and is younger than ttl (open_ttl if it predates settled_at)"""
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return False
+        if settled_at is not None and mtime < settled_at:
+            ttl = self.open_ttl
+        return time.time() - mtime < ttl
+
+    def mark_month(self, station, report_type, year, month):
+        self.mark(self.month_path(station, report_type, year, month))
+
+    def clear_month(self, station, report_type, year, month):
+        try:
+            os.remove(self.month_path(station, report_type, year, month))
+        except OSError:
+            pass
+
+    def month_is_empty(self, station, report_type, year, month):
+        return self.younger_than(self.month_path(station, report_type, year, month), self.ttl,
+                                 response_cache.settled_at(year, month))
+
+    def mark_station(self, station):
+        self.mark(self.station_path(station))
+
+    def station_is_unknown(self, station):
+        return self.younger_than(self.station_path(station), self.ttl)
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU of strings (or anything whose len() is its size) bounded by total size"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = value
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, key):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class MonthIndex:
+    """One month of clean reports with their observation times, for bisecting
+
+    Clean data is already sorted by ddhhmm, so the times come out sorted.
+    len() is the size of the text it was built from (for LRUCache).
+    """
+    def __init__(self, clean_data, year, month):
+        self.source = clean_data
+        self.reports = [report for report in clean_data.split('\n') if report]
+        month_start = timegm((int(year), int(month), 1, 0, 0, 0))
+        self.times = array('q')
+        for report in self.reports:
+            key = report_sort_key(report)
+            # Reports without a time ('000000') sort first, at the start of the month
+            day = max(int(key[:2]), 1)
+            self.times.append(month_start + ((day - 1) * 24 + int(key[2:4])) * 3600 + int(key[4:6]) * 60)
+
+    def __len__(self):
+        return len(self.source)
+
+    def between(self, start, end):
+        """Reports observed in [start, end) (epoch seconds)"""
+        return self.reports[bisect_left(self.times, start):bisect_left(self.times, end)]
+
+
+class ArchiveView:
+    """Zero-copy view of archived rows
+
+    Numeric columns are memoryviews over the memory-mapped files, cast to
+    their MetarTable type codes; text columns are the raw fixed-width bytes
+    (use text() to read one value). Slicing never copies.
+    """
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def rows_between(self, start, end):
+        """View of the rows observed in [start, end) (epoch seconds), found by bisecting the time column"""
+        times = self.columns['time']
+        return self.row_slice(bisect_left(times, start), bisect_left(times, end))
+
+    def row_slice(self, first, last):
+        width = StationArchive.TEXT_WIDTH
+        columns = {}
+        for name, column in self.columns.items():
+            if name in MetarTable.TEXT:
+                columns[name] = column[first * width:last * width]
+            else:
+                columns[name] = column[first:last]
+        return ArchiveView(columns, last - first)
+
+    def text(self, name, row):
+        width = StationArchive.TEXT_WIDTH
+        return bytes(self.columns[name][row * width:(row + 1) * width]).rstrip(b'\0').decode('utf-8', 'ignore')
+
+    def to_table(self):
+        """Copy the rows into a MetarTable"""
+        table = MetarTable()
+        for name, code in MetarTable.NUMERIC:
+            table.columns[name] = array(code, self.columns[name])
+        for name in MetarTable.TEXT:
+            table.columns[name] = [self.text(name, row) for row in range(self.rows)]
+        return table
+
+    def to_json(self):
+        return self.to_table().to_json()
+
+
+class StationArchive:
+    """Append-only binary column store of one station's decoded METARs
+
+    Every MetarTable column is a file of fixed-width values in native byte
+    order (text columns padded to TEXT_WIDTH bytes), and index.json is the
+    time index: yyyymm -> [first row, end row]. Only closed months go in, so
+    a month never changes once written. Months arriving in time order are
+    plain appends; an older month rewrites the files under the next
+    generation number and switches the index over, so readers that already
+    mapped the old files keep a consistent view.
+    """
+    TEXT_WIDTH = 32
+
+    def __init__(self, station, directory=ARCHIVE_DIR):
+        check_target(station, 'METAR')
+        self.directory = os.path.join(directory, station)
+        self.lock = threading.Lock()
+
+    def column_path(self, name, generation):
+        return os.path.join(self.directory, f"{name}.{generation}.bin")
+
+    def index(self):
+        try:
+            with open(os.path.join(self.directory, 'index.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'generation': 0, 'months': {}}
+
+    def write_index(self, index):
+        path = os.path.join(self.directory, 'index.json')
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def encode(self, table):
+        """(column name, bytes) for every column of a MetarTable"""
+        width = self.TEXT_WIDTH
+        for name, _ in MetarTable.NUMERIC:
+            yield name, table[name].tobytes()
+        for name in MetarTable.TEXT:
+            yield name, b''.join(value.encode('utf-8')[:width].ljust(width, b'\0') for value in table[name])
+
+    def append_months(self, tables):
+        """Add closed months' decoded reports, given as {(year, month): MetarTable}
+
+        Months that are already archived are skipped. Returns the months added.
+        """
+        with self.lock:
+            index = self.index()
+            months = index['months']
+            new = {f"{year}{month}": table for (year, month), table in tables.items()
+                   if f"{year}{month}" not in months}
+            if not new:
+                return []
+            os.makedirs(self.directory, exist_ok=True)
+            if months and min(new) < max(months):
+                self.rebuild(index, new)
+                return sorted(new)
+            
+            rows = max((end for _, end in months.values()), default=0)
+            merged = MetarTable()
+            for key in sorted(new):
+                months[key] = [rows + len(merged), rows + len(merged) + len(new[key])]
+                merged.extend(new[key])
+            for name, data in self.encode(merged):
+                path = self.column_path(name, index['generation'])
+                with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                    # Drop anything an interrupted append left past the index
+                    f.truncate(rows * (self.TEXT_WIDTH if name in MetarTable.TEXT else merged[name].itemsize))
+                    f.seek(0, os.SEEK_END)
+                    f.write(data)
+            self.write_index(index)
+            return sorted(new)
+
+    def rebuild(self, index, new):
+        """Rewrite every column with the new months inserted in month order"""
+        view = self.open(index)
+        merged = MetarTable()
+        months = {}
+        for key in sorted([*index['months'], *new]):
+            part = new[key] if key in new else view.row_slice(*index['months'][key]).to_table()
+            months[key] = [len(merged), len(merged) + len(part)]
+            merged.extend(part)
+        
+        old_generation = index['generation']
+        generation = old_generation + 1
+        for name, data in self.encode(merged):
+            with open(self.column_path(name, generation), 'wb') as f:
+                f.write(data)
+        self.write_index({'generation': generation, 'months': months})
+        for name in merged.columns:
+            try:
+                os.remove(self.column_path(name, old_generation))
+            except OSError:
+                pass
+        print(f"🗄️ Rebuilt archive {self.directory} with {', '.join(sorted(new))} ({len(merged)} rows)")
+
+    def open(self, index=None):
+        """Memory-map every archived row; returns an ArchiveView"""
+        index = index or self.index()
+        rows = max((end for _, end in index['months'].values()), default=0)
+        columns = {}
+        for name, code in MetarTable.NUMERIC:
+            columns[name] = self.map(name, index['generation'], rows * array(code).itemsize).cast(code)
+        for name in MetarTable.TEXT:
+            columns[name] = self.map(name, index['generation'], rows * self.TEXT_WIDTH)
+        return ArchiveView(columns, rows)
+
+    def map(self, name, generation, size):
+        if not size:
+            return memoryview(b'')
+        with open(self.column_path(name, generation), 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # The view keeps the mapping alive; the file can be closed
+        return memoryview(mapped)[:size]
+
+
+class ArchiveStore:
+    """One StationArchive per station, shared by all threads"""
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.archives = {}
+        self.lock = threading.Lock()
+
+    def get(self, station):
+        with self.lock:
+            if station not in self.archives:
+                self.archives[station] = StationArchive(station, self.directory)
+            return self.archives[station]
+
+
+class RateLimiter:
+    """Process-wide token bucket for upstream calls that adapts to pushback
+
+    The rate is halved whenever upstream throttles, errors or times out and
+    climbs back towards the configured rate in small steps on each success.
+    """
+    def __init__(self, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST, min_rate=UPSTREAM_MIN_RATE):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until this caller may hit upstream; returns seconds waited"""
+        with self.lock:
+            self.refill()
+            # Reserve a token now (possibly going negative) so waiters queue in order
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self):
+        with self.lock:
+            self.refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+        print(f"🐢 Upstream pushback - rate lowered to {self.rate:.3f} req/s")
+
+    def reward(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.refill()
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Seconds to wait before retry number `attempt` (1, 2, ...): exponential with full jitter"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class RetryBudget:
+    """Caps retries across all threads to a share of first attempts
+
+    Each first attempt adds `ratio` of a token and each retry spends one, up
+    to `reserve` tokens, so while upstream is failing retries add at most
+    `ratio` extra load instead of multiplying it.
+    """
+    def __init__(self, ratio=RETRY_BUDGET, reserve=RETRY_RESERVE):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = float(reserve)
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.reserve, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """Take a token for one retry; False if the budget is spent"""
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class UpstreamUnavailable(requests.exceptions.RequestException):
+    """Raised instead of calling upstream while the circuit breaker is open"""
+
+
+class UpstreamThrottled(requests.exceptions.RequestException):
+    """Upstream answered with a quota or rate-limit page"""
+
+
+class MalformedResponse(requests.exceptions.RequestException):
+    """Upstream answered with something that is neither data nor a known message"""
+
+
+class UnknownStation(Exception):
+    """Upstream does not know the station - asking again will not help"""
+
+
+class CircuitBreaker:
+    """Fails upstream calls fast while Ogimet is unhealthy
+
+    closed: calls go through; `failures` consecutive failures open it.
+    open: calls raise UpstreamUnavailable for `reset` seconds.
+    half-open: up to `probes` calls go through; a success closes the
+    circuit, a failure opens it again.
+    """
+    def __init__(self, failures=CIRCUIT_FAILURES, reset=CIRCUIT_RESET, probes=CIRCUIT_PROBES):
+        self.threshold = failures
+        self.reset = reset
+        self.probes = probes
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.reset:
+                    return False
+                self.state = 'half-open'
+                self.probing = 0
+                print("🚧 Upstream circuit half-open, probing")
+            if self.state == 'half-open':
+                if self.probing >= self.probes:
+                    return False
+                self.probing += 1
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            if self.state != 'closed':
+                self.state = 'closed'
+                print("✅ Upstream circuit closed")
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half-open' or (self.state == 'closed' and self.failures >= self.threshold):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                print(f"🚧 Upstream circuit open for {self.reset:.0f}s after {self.failures} failures")
+
+
+class UpstreamClient:
+    """Long-lived, pooled HTTP session to Ogimet shared by all threads
+
+    Cookies are primed once and only refreshed when they expire or upstream
+    rejects a request, so a warm fetch is a single POST on a kept-alive
+    connection.
+    """
+    FORM_URL = 'https://www.ogimet.com/display_metars2.php?lang=en'
+    POST_URL = 'https://www.ogimet.com/display_metars2.php'
+    HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    }
+
+    def __init__(self, pool_size=UPSTREAM_POOL_SIZE, cookie_ttl=COOKIE_TTL):
+        self.cookie_ttl = cookie_ttl
+        self.primed_at = 0
+        self.prime_lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers.update(self.HEADERS)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    THROTTLE_MARKERS = ('quota limit', 'too many requests', 'rate limit')
+    UNKNOWN_STATION_MARKERS = ('unknown station', 'station not found', 'no existe la estacion',
+                               'not a valid icao', 'no such station')
+    NO_REPORTS_MARKERS = ('no metar', 'no taf', 'no hay', 'no reports')
+    PRE_BLOCK_RE = re.compile(r'<pre[^>]*>(.*?)</pre>', re.S)
+    TAG_RE = re.compile(r'<[^>]+>')
+
+    def looks_throttled(self, text):
+        head = text[:4096].lower()
+        return any(marker in head for marker in self.THROTTLE_MARKERS)
+
+    def classify(self, status_code, head, reports):
+        """What a response is: 'data', 'empty', 'unknown-station', 'throttled' or 'malformed'
+
+        head is the start of the body and reports the number of reports the
+        cleaners found in it. 'empty' is only returned for an explicit
+        no-reports message or an empty results block.
+        """
+        if status_code == 429 or self.looks_throttled(head):
+            return 'throttled'
+        if reports:
+            return 'data'
+        text = head[:16384].lower()
+        if any(marker in text for marker in self.UNKNOWN_STATION_MARKERS):
+            return 'unknown-station'
+        if status_code >= 400:
+            return 'malformed'
+        if any(marker in text for marker in self.NO_REPORTS_MARKERS):
+            return 'empty'
+        # A results block holding nothing but blank and comment lines is also a real empty answer;
+        # anything else (busy pages, odd HTML) is retried rather than trusted as "no reports"
+        blocks = self.PRE_BLOCK_RE.findall(text)
+        if blocks and all(line.strip().startswith('#') or not line.strip()
+                          for block in blocks for line in self.TAG_RE.sub('', block).split('\n')):
+            return 'empty'
+        return 'malformed'
+
+    def request(self, method, url, stream=False, **kwargs):
+        """Send one request through the rate limiter and report pushback to it
+
+        With stream=True the body is left unread; the caller passes the first
+        part of it to settle() once it has been seen. Raises
+        UpstreamUnavailable without sending anything while the circuit is open.
+        """
+        if not breaker.allow():
+            metrics.inc('ogimet_upstream_requests_total', method=method, outcome='circuit_open')
+            raise UpstreamUnavailable("Upstream circuit open")
+        metrics.inc('ogimet_rate_limit_wait_seconds_total', rate_limiter.acquire())
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, stream=stream, **kwargs)
+        except requests.exceptions.RequestException as e:
+            # Every failed send reports back, otherwise a half-open probe slot is never released
+            if isinstance(e, requests.exceptions.Timeout):
+                outcome = 'timeout'
+            elif isinstance(e, requests.exceptions.ConnectionError):
+                outcome = 'connection_error'
+            else:
+                outcome = 'error'
+            metrics.inc('ogimet_upstream_requests_total', method=method, outcome=outcome)
+            rate_limiter.penalize()
+            breaker.failure()
+            raise
+        metrics.observe('ogimet_upstream_request_seconds', time.perf_counter() - start, method=method)
+        metrics.inc('ogimet_upstream_requests_total', method=method, outcome=str(response.status_code))
+        if not stream:
+            metrics.inc('ogimet_upstream_bytes_total', len(response.content))
+        if response.status_code >= 500:
+            breaker.failure()
+        else:
+            breaker.success()
+        if response.status_code == 429 or response.status_code >= 500:
+            rate_limiter.penalize()
+        elif not stream:
+            self.settle(response.text)
+        return response
+
+    def settle(self, text):
+        """Slow down if the body is a throttling page, speed back up otherwise"""
+        if self.looks_throttled(text):
+            rate_limiter.penalize()
+        else:
+            rate_limiter.reward()
+
+    def prime(self, force=False):
+        """Fetch the form page to get session cookies, unless they are still fresh"""
+        with self.prime_lock:
+            if not force and time.time() - self.primed_at < self.cookie_ttl:
+                return
+            try:
+                self.request('GET', self.FORM_URL, timeout=30)
+                self.primed_at = time.time()
+            except UpstreamUnavailable:
+                raise
+            except requests.exceptions.RequestException as e:
+                # Ogimet usually answers without cookies too - try the POST anyway
+                print(f"  Cookie priming failed: {e}")
+
+    def post(self, form_data, timeout=90, stream=False):
+        """POST the query form, re-priming cookies once if upstream rejects us"""
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Referer': self.FORM_URL,
+        }
+        self.prime()
+        response = self.request('POST', self.POST_URL, data=form_data, headers=headers,
+                                timeout=timeout, stream=stream)
+        if response.status_code in (401, 403, 419):
+            response.close()
+            self.prime(force=True)
+            response = self.request('POST', self.POST_URL, data=form_data, headers=headers,
+                                    timeout=timeout, stream=stream)
+        return response
+
+
+class DebugDumper:
+    """Writes debug copies of upstream responses on a background thread
+
+    mode is 'off', 'sampled' (a random sample_rate share of responses) or
+    'on-error' (only responses that produced no data). The directory is kept
+    under max_bytes by deleting the oldest dumps; if the writer falls behind,
+    new dumps are dropped rather than slowing requests down.
+    """
+    def __init__(self, mode=DEBUG_DUMPS, sample_rate=DEBUG_SAMPLE_RATE, directory=DEBUG_DIR,
+                 max_bytes=DEBUG_DIR_BYTES):
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue(maxsize=64)
+        self.files = None  # path -> size, oldest first; scanned by the writer thread
+        self.size = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def wants(self):
+        """Whether to keep the raw lines of the next response: None (no), 'always' or 'error'"""
+        if self.mode == 'sampled':
+            return 'always' if random.random() < self.sample_rate else None
+        if self.mode == 'on-error':
+            return 'error'
+        return None
+
+    def capture(self, name, text):
+        """Queue text to be written as DEBUG_DIR/name"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='debug-dumps', daemon=True)
+                self.thread.start()
+        try:
+            self.queue.put_nowait((name, text))
+        except queue.Full:
+            pass
+
+    def run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        self.files = OrderedDict((path, size) for _, path, size in sorted(entries))
+        self.size = sum(self.files.values())
+        while True:
+            name, text = self.queue.get()
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                self.size -= self.files.pop(path, 0)
+                self.files[path] = os.path.getsize(path)
+                self.size += self.files[path]
+                # Rotate: drop the oldest dumps until we are under the cap again
+                while self.size > self.max_bytes and len(self.files) > 1:
+                    old_path, old_size = self.files.popitem(last=False)
+                    self.size -= old_size
+                    os.remove(old_path)
+            except OSError as e:
+                print(f"⚠️ Debug dump failed: {e}")
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution
+
+    The first caller runs the function; callers arriving while it is still
+    running wait for and share its result (or exception).
+    """
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            print(f"    {key}: ⏳ joining in-flight fetch")
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+class DaemonThreadPool:
+    """Minimal ThreadPoolExecutor stand-in (submit, map, shutdown, with) on daemon threads
+
+    Executor workers keep the process alive until every queued task has run,
+    so Ctrl+C would wait for running jobs; these threads die with the process.
+    """
+    def __init__(self, max_workers, thread_name_prefix='pool'):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self.tasks = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self.tasks.put((future, fn, args, kwargs))
+        with self.lock:
+            if len(self.threads) < self.max_workers:
+                thread = threading.Thread(target=self.work, daemon=True,
+                                          name=f"{self.thread_name_prefix}_{len(self.threads)}")
+                self.threads.append(thread)
+                thread.start()
+        return future
+
+    def map(self, fn, items):
+        futures = [self.submit(fn, item) for item in items]
+        return (future.result() for future in futures)
+
+    def work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            future, fn, args, kwargs = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        if cancel_futures:
+            while True:
+                try:
+                    task = self.tasks.get_nowait()
+                except queue.Empty:
+                    break
+                if task is not None:
+                    task[0].cancel()
+        with self.lock:
+            threads = list(self.threads)
+        for _ in threads:
+            self.tasks.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown(wait=True)
+
+
+metrics = Metrics()
+metrics.counter('ogimet_upstream_requests_total', 'Upstream HTTP requests by method and outcome')
+metrics.histogram('ogimet_upstream_request_seconds', 'Time until upstream response headers arrive')
+metrics.counter('ogimet_upstream_responses_total', 'Classified upstream query responses by kind')
+metrics.counter('ogimet_upstream_bytes_total', 'Response body bytes downloaded from upstream')
+metrics.counter('ogimet_rate_limit_wait_seconds_total', 'Time spent waiting for the upstream rate limiter')
+metrics.counter('ogimet_retries_total', 'Retried upstream fetches by reason of the failed attempt')
+metrics.counter('ogimet_retry_sleep_seconds_total', 'Time spent in backoff sleeps between retries')
+metrics.histogram('ogimet_parse_seconds', 'Time cleaning one upstream response, excluding network reads')
+metrics.histogram('ogimet_reports_per_month', 'Reports in a downloaded month',
+                  buckets=(0, 10, 50, 100, 250, 500, 1000, 1500, 2000, 3000, 5000, 10000))
+metrics.histogram('ogimet_file_write_seconds', 'Time writing a downloaded month file')
+metrics.histogram('ogimet_render_seconds', 'Time rendering an HTML result page')
+metrics.histogram('ogimet_http_request_seconds', 'Time serving an HTTP request by route')
+rate_limiter = RateLimiter()
+retry_budget = RetryBudget()
+breaker = CircuitBreaker()
+upstream = UpstreamClient()
+inflight = SingleFlight()
+debug_dumps = DebugDumper()
+response_cache = ResponseCache()
+negative_cache = NegativeCache()
+clean_cache = LRUCache(MEMORY_CACHE_BYTES)
+page_cache = LRUCache(PAGE_CACHE_BYTES)
+index_cache = LRUCache(INDEX_CACHE_BYTES)
+archives = ArchiveStore()
+
+
+class MetarDownloader:
+    """Fetch, clean and save METAR/TAF data from Ogimet"""
+    def download_single_month(self, station, year, month, report_type):
+        """Download single month with original cleaning"""
+        result = {
+            'success': False,
+            'filename': '',
+            'reports': 0,
+            'error': '',
+            'clean_data': '',
+            'report_type': report_type
+        }
+        
+        try:
+            print(f"Downloading {report_type} {station} {year}-{month}...")
+            
+            # Get data with original cleaning
+            clean_data, _ = self.get_weather_data_with_retry(station, year, month, report_type)
+            
+            if clean_data and len(clean_data.strip()) > 0:
+                # Save file with CORRECT naming (original format)
+                if report_type == 'METAR':
+                    filename = f"METAR{year}{month}.txt"
+                else:  # TAF
+                    filename = f"TAF{year}{month}.txt"
+                
+                with metrics.timer('ogimet_file_write_seconds'), open(filename, 'w', encoding='utf-8') as f:
+                    f.write(clean_data)
+                
+                # Count reports - count each TAF issuance
+                if report_type == 'TAF':
+                    # Count TAF lines (lines starting with TAF)
+                    lines = clean_data.strip().split('\n')
+                    report_count = len([l for l in lines if l.strip() and 'TAF' in l])
+                else:
+                    lines = clean_data.strip().split('\n')
+                    report_count = len([l for l in lines if l.strip()])
+                
+                metrics.observe('ogimet_reports_per_month', report_count, type=report_type)
+                result['success'] = True
+                result['filename'] = filename
+                result['reports'] = report_count
+                result['clean_data'] = clean_data
+                
+                print(f"✅ Saved {report_count} {report_type} reports to {filename}")
+            else:
+                result['error'] = f"No {report_type} data found"
+                print(f"❌ No {report_type} data found")
+                
+        except Exception as e:
+            result['error'] = str(e)
+            print(f"❌ Exception: {e}")
+        
+        return result
+
+    def download_all_months(self, station, year, report_type, progress=None):
+        """Download all 12 months concurrently, paced by the shared upstream rate limiter
+
+        progress, if given, is called as progress(month, status, reports, error)
+        when a month starts ('running') and when it finishes ('done'/'failed').
+        """
+        file_prefix = 'METAR' if report_type == 'METAR' else 'TAF'
+        folder_name = f"{file_prefix}_{station}_{year}"
+        os.makedirs(folder_name, exist_ok=True)
+        
+        print(f"\n🚀 Starting {report_type} batch download for {station} {year}")
+        print(f"📁 Saving to folder: {folder_name}")
+        
+        # Ask for the uncached months in wide windows first
+        prefetched = self.prefetch_year(station, report_type, year) if RANGE_MONTHS > 1 else {}
+        
+        # Months run concurrently; the shared rate limiter keeps upstream load in check
+        def fetch(month_num):
+            month = f"{month_num:02d}"
+            end_day = month_end_day(year, month)
+            return self.download_month_to_folder(
+                station, year, month, report_type, end_day, folder_name, progress,
+                # Months a range response showed to be empty need no further request
+                clean_data='' if self.known_empty(station, report_type, year, month, prefetched) else None
+            )
+        
+        # map() yields in submission order, so results stay January..December
+        with DaemonThreadPool(max_workers=MONTH_CONCURRENCY, thread_name_prefix='metar-month') as pool:
+            results = list(pool.map(fetch, range(1, 13)))
+        
+        print(f"\n🎉 Batch download completed!")
+        print(f"   ✅ Successful: {sum(1 for r in results if r['success'])}/12 months")
+        print(f"   📊 Total reports: {sum(r['reports'] for r in results if r['success']):,}")
+        
+        return {
+            'station': station,
+            'year': year,
+            'report_type': report_type,
+            'folder': folder_name,
+            'results': results,
+            'total_success': sum(1 for r in results if r['success']),
+            'total_reports': sum(r['reports'] for r in results if r['success'])
+        }
+
+    def decode_month(self, station, year, month):
+        """Fetch (or reuse) a month of METAR reports and decode it into a MetarTable"""
+        clean_data, _ = self.get_weather_data_with_retry(station, year, month, 'METAR')
+        return decode_metar_month(clean_data or '', year, month)
+
+    def decode_year(self, station, year):
+        """Decode every month of a year, in time order
+
+        Closed months come from (and are added to) the station's binary
+        archive. If the whole year is archived the result is a zero-copy
+        ArchiveView, otherwise a MetarTable.
+        """
+        archive = archives.get(station)
+        months = [f"{month_num:02d}" for month_num in range(1, 13)]
+        archived = archive.index()['months']
+        missing = [month for month in months if f"{year}{month}" not in archived]
+        closed_tables = {}
+        open_tables = []
+        if missing:
+            prefetched = self.prefetch_year(station, 'METAR', year) if RANGE_MONTHS > 1 else {}
+            for month in missing:
+                # Only a fresh range response counts as proof for the permanent archive
+                empty = prefetched.get((year, month)) == 0
+                skip = empty or self.known_empty(station, 'METAR', year, month, prefetched)
+                table = MetarTable() if skip else self.decode_month(station, year, month)
+                # Only data written after the month settled is final (a stale copy served
+                # while upstream fails may be a half month)
+                final = response_cache.is_final(station, 'METAR', year, month, month_end_day(year, month))
+                if response_cache.is_closed(year, month) and (empty or (len(table) and final)):
+                    closed_tables[(year, month)] = table
+                else:
+                    # Still changing (or failed to download) - not archived yet
+                    open_tables.append(table)
+            archive.append_months(closed_tables)
+        
+        view = archive.open().rows_between(timegm((int(year), 1, 1, 0, 0, 0)),
+                                           timegm((int(year) + 1, 1, 1, 0, 0, 0)))
+        if not any(len(table) for table in open_tables):
+            return view
+        table = view.to_table()
+        for part in open_tables:
+            table.extend(part)
+        return table
+
+    def query_reports(self, station, report_type, start, end):
+        """Reports observed in [start, end) (UTC datetimes), oldest first
+
+        Each month is answered from its cached clean data through a MonthIndex
+        (bisect, so O(log n + k) once the month is in memory). Only months
+        missing from the caches are fetched, consecutive ones in range requests.
+        """
+        months = []
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            months.append((str(year), f"{month:02d}"))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        
+        missing = [(y, m) for y, m in months if self.needs_full_fetch(station, report_type, y, m)]
+        covered = {}
+        if RANGE_MONTHS > 1:
+            for run in self.consecutive_runs(missing):
+                if len(run) > 1:
+                    covered.update(self.fetch_month_range(station, report_type, run))
+        
+        start_time = timegm(start.timetuple())
+        end_time = timegm(end.timetuple())
+        reports = []
+        for y, m in months:
+            if covered.get((y, m)) == 0:
+                continue
+            end_day = month_end_day(y, m)
+            clean_data, _ = self.get_weather_data_with_retry(station, y, m, report_type, end_day)
+            if not clean_data:
+                continue
+            key = (station, report_type, y, m, end_day)
+            index = index_cache.get(key)
+            if index is None or not (index.source is clean_data or index.source == clean_data):
+                index = MonthIndex(clean_data, y, m)
+                index_cache.put(key, index)
+            reports.extend(index.between(start_time, end_time))
+        return reports
+
+    def prefetch_year(self, station, report_type, year):
+        """Range-fetch the uncached months of a year into the on-disk cache
+
+        Returns {(year, month): report count} for the months the range requests covered.
+        """
+        return inflight.do(('range', station, report_type, year),
+                           lambda: self.fetch_year_ranges(station, report_type, year))
+
+    def fetch_year_ranges(self, station, report_type, year):
+        """Body of prefetch_year, run once per station/type/year at a time"""
+        missing = [(year, f"{m:02d}") for m in range(1, 13)
+                   if self.needs_full_fetch(station, report_type, year, f"{m:02d}")]
+        prefetched = {}
+        for run in self.consecutive_runs(missing):
+            if len(run) > 1:
+                prefetched.update(self.fetch_month_range(station, report_type, run))
+        return prefetched
+
+    def download_bulk(self, stations, start_year, end_year, report_type, folder_name, progress=None):
+        """Download every station x month from start_year to end_year into one folder
+
+        Work units are interleaved across stations so each station gets a fair
+        share of the upstream budget. progress, if given, is called as
+        progress(station, status, reports, error) when a unit finishes.
+        """
+        years = [str(y) for y in range(int(start_year), int(end_year) + 1)]
+        for station in stations:
+            os.makedirs(os.path.join(folder_name, station), exist_ok=True)
+        
+        # Year/month-major, station-minor: a station-major order would make
+        # the last station wait for all the others
+        units = [(station, year, f"{m:02d}") for year in years for m in range(1, 13) for station in stations]
+        print(f"\n🚀 Starting {report_type} bulk download: {len(stations)} stations, "
+              f"{years[0]}-{years[-1]}, {len(units)} months")
+        
+        prefetched = {}
+        prefetch_locks = {}
+        locks_guard = threading.Lock()
+        
+        def run(unit):
+            station, year, month = unit
+            clean_data = None
+            if RANGE_MONTHS > 1:
+                # The first unit of a station-year range-fetches the whole year
+                with locks_guard:
+                    year_lock = prefetch_locks.setdefault((station, year), threading.Lock())
+                with year_lock:
+                    if (station, year) not in prefetched:
+                        prefetched[(station, year)] = self.prefetch_year(station, report_type, year)
+                if self.known_empty(station, report_type, year, month, prefetched[(station, year)]):
+                    clean_data = ''
+            result = self.download_month_to_folder(
+                station, year, month, report_type, month_end_day(year, month),
+                os.path.join(folder_name, station), clean_data=clean_data
+            )
+            result['station'] = station
+            result['year'] = year
+            if progress:
+                progress(station, 'done' if result['success'] else 'failed',
+                         result['reports'], result.get('error', ''))
+            return result
+        
+        # map() hands units to workers in the interleaved order above
+        with DaemonThreadPool(max_workers=BULK_CONCURRENCY, thread_name_prefix='metar-bulk') as pool:
+            results = list(pool.map(run, units))
+        
+        per_station = {}
+        for result in results:
+            totals = per_station.setdefault(result['station'], {'success': 0, 'reports': 0})
+            if result['success']:
+                totals['success'] += 1
+                totals['reports'] += result['reports']
+        
+        print(f"\n🎉 Bulk download completed!")
+        print(f"   ✅ Successful: {sum(1 for r in results if r['success'])}/{len(units)} months")
+        
+        return {
+            'stations': stations,
+            'start_year': years[0],
+            'end_year': years[-1],
+            'report_type': report_type,
+            'folder': folder_name,
+            'results': results,
+            'per_station': per_station,
+            'total_units': len(units),
+            'total_success': sum(1 for r in results if r['success']),
+            'total_reports': sum(r['reports'] for r in results if r['success'])
+        }
+
+    def download_month_to_folder(self, station, year, month, report_type, end_day, folder_name, progress=None,
+                                 clean_data=None):
+        """Fetch one month of a batch into folder_name and return its result entry
+
+        clean_data, if given, is already-fetched data for the month ('' = none).
+        """
+        file_prefix = 'METAR' if report_type == 'METAR' else 'TAF'
+        month_name = MONTH_NAMES.get(month, f"Month {month}")
+        
+        print(f"  📅 {month_name} ({year}-{month}) started")
+        if progress:
+            progress(month, 'running')
+        
+        try:
+            if clean_data is None:
+                # Get data with retry logic (served from cache when possible)
+                on_retry = None
+                if progress:
+                    def on_retry(attempt, reason):
+                        progress(month, 'retrying', 0, f"attempt {attempt} failed: {reason}")
+                clean_data, _ = self.get_weather_data_with_retry(
+                    station, year, month, report_type, end_day, on_retry=on_retry
+                )
+            
+            if clean_data and len(clean_data.strip()) > 0:
+                # CORRECT file naming (original format)
+                filename = os.path.join(folder_name, f"{file_prefix}{year}{month}.txt")
+                
+                with metrics.timer('ogimet_file_write_seconds'), open(filename, 'w', encoding='utf-8') as f:
+                    f.write(clean_data)
+                
+                # Count reports
+                if report_type == 'TAF':
+                    lines = clean_data.strip().split('\n')
+                    report_count = len([l for l in lines if l.strip() and 'TAF' in l])
+                else:
+                    lines = clean_data.strip().split('\n')
+                    report_count = len([l for l in lines if l.strip()])
+                
+                result = {
+                    'month': month,
+                    'month_name': month_name,
+                    'filename': filename,
+                    'reports': report_count,
+                    'success': True
+                }
+                
+                metrics.observe('ogimet_reports_per_month', report_count, type=report_type)
+                print(f"  📅 {month_name}: ✅ {report_count} reports saved")
+            else:
+                result = {
+                    'month': month,
+                    'month_name': month_name,
+                    'filename': '',
+                    'reports': 0,
+                    'success': False,
+                    'error': f'No {report_type} data'
+                }
+                print(f"  📅 {month_name}: ❌ No data found")
+                
+        except Exception as e:
+            result = {
+                'month': month,
+                'month_name': month_name,
+                'filename': '',
+                'reports': 0,
+                'success': False,
+                'error': str(e)
+            }
+            print(f"  📅 {month_name}: ❌ Error: {str(e)[:50]}...")
+        
+        if progress:
+            progress(month, 'done' if result['success'] else 'failed',
+                     result['reports'], result.get('error', ''))
+        return result
+
+    def consecutive_runs(self, months):
+        """Group sorted (year, month) pairs into runs of consecutive months"""
+        runs = []
+        for year, month in months:
+            index = int(year) * 12 + int(month)
+            if runs and runs[-1][1] == index - 1:
+                runs[-1][0].append((year, month))
+                runs[-1][1] = index
+            else:
+                runs.append([[(year, month)], index])
+        return [run for run, _ in runs]
+
+    def needs_full_fetch(self, station, report_type, year, month):
+        """True if nothing is stored for the month (stale copies are refreshed by delta sync
+        instead, and known-empty months are not asked for at all)"""
+        end_day = month_end_day(year, month)
+        return (self.get_cached_data(station, report_type, year, month, end_day) is None
+                and not response_cache.has(station, report_type, year, month, end_day)
+                and not negative_cache.month_is_empty(station, report_type, year, month))
+
+    def known_empty(self, station, report_type, year, month, prefetched):
+        """True if a range response just now, or the negative cache, says the month has no reports"""
+        return (prefetched.get((year, month)) == 0
+                or negative_cache.station_is_unknown(station)
+                or negative_cache.month_is_empty(station, report_type, year, month))
+
+    def delta_start(self, base, year, month):
+        """(day, hour, minute) to ask from when refreshing `base`, or None for the whole month"""
+        key = report_sort_key(base.rsplit('\n', 1)[-1])
+        if key == '000000':
+            return None
+        try:
+            newest = datetime(int(year), int(month), int(key[:2]), int(key[2:4]), int(key[4:6]))
+        except ValueError:
+            return None
+        # Re-ask a little before the newest report to pick up late and corrected ones
+        start = newest - timedelta(minutes=DELTA_OVERLAP)
+        if start.month != int(month):
+            return None
+        return f"{start.day:02d}", f"{start.hour:02d}", f"{start.minute:02d}"
+
+    def merge_reports(self, base, new):
+        """Merge new clean reports into sorted clean data, dropping exact duplicates"""
+        reports = list(dict.fromkeys(report for report in itertools.chain(base.split('\n'), new.split('\n'))
+                                     if report))
+        # Both inputs are sorted, so this is a cheap two-run merge
+        reports.sort(key=report_sort_key)
+        return '\n'.join(reports)
+
+    def cache_clean_data(self, station, report_type, year, month, end_day, clean_data):
+        negative_cache.clear_month(station, report_type, year, month)
+        key = (station, report_type, year, month, end_day)
+        clean_cache.put(key, clean_data)
+        response_cache.put(*key, clean_data)
+
+    def get_cached_data(self, station, report_type, year, month, end_day):
+        """Clean data from memory, then disk; None if neither has it"""
+        key = (station, report_type, year, month, end_day)
+        clean_data = clean_cache.get(key)
+        if clean_data is None:
+            clean_data = response_cache.get(*key)
+            if clean_data is not None:
+                clean_cache.put(key, clean_data)
+        elif not response_cache.is_fresh(*key):
+            # Current month expired on disk - the memory copy is stale too
+            return None
+        return clean_data
+
+    def get_weather_data_with_retry(self, station, year, month, report_type='METAR', end_day=None, retries=3,
+                                    on_retry=None, refresh=False):
+        """Get data with retry logic, answering from the on-disk cache when possible
+
+        on_retry, if given, is called as on_retry(attempt, reason) before each retry.
+        refresh=True skips the cache lookup and asks upstream (delta sync for open months).
+        """
+        # Everything below builds file paths from these
+        check_target(station, report_type, year, month)
+        end_day = end_day or month_end_day(year, month)
+        if negative_cache.station_is_unknown(station):
+            return "", f"Unknown station {station}"
+        if not refresh and negative_cache.month_is_empty(station, report_type, year, month):
+            print(f"    {station} {year}-{month}: 📭 Known empty")
+            return "", "No reports"
+        cached = None if refresh else self.get_cached_data(station, report_type, year, month, end_day)
+        if cached is not None:
+            print(f"    {station} {year}-{month}: 💾 Cache hit")
+            return cached, ''
+        
+        # Identical requests already on their way upstream are shared, not repeated
+        return inflight.do(
+            (station, report_type, year, month, end_day),
+            lambda: self.fetch_with_retries(station, year, month, report_type, end_day, retries, on_retry)
+        )
+
+    def fetch_with_retries(self, station, year, month, report_type, end_day, retries, on_retry=None):
+        """Ask upstream up to `retries` times and cache the first good answer
+
+        A month whose stored copy is not final (written before the month
+        settled) is delta-synced: only reports since the newest stored one
+        are asked for and merged in.
+        """
+        base = None
+        if not response_cache.is_final(station, report_type, year, month, end_day):
+            base = response_cache.get(station, report_type, year, month, end_day, stale_ok=True) or None
+        since = self.delta_start(base, year, month) if base else None
+        
+        # Retries back off exponentially with jitter (longer after a quota
+        # page) and come out of a budget shared by all threads; every attempt
+        # also waits for the rate limiter
+        retry_budget.deposit()
+        reason = ''
+        for attempt in range(retries):
+            # One line per attempt - months of a batch print concurrently
+            label = f"    {station} {year}-{month} attempt {attempt + 1}/{retries}:"
+            if attempt:
+                if not retry_budget.withdraw():
+                    print(f"{label} 💸 Retry budget spent")
+                    break
+                if on_retry:
+                    on_retry(attempt, reason)
+                base_delay = THROTTLE_BASE_DELAY if reason == 'throttled' else RETRY_BASE_DELAY
+                delay = backoff_delay(attempt, base=base_delay)
+                metrics.inc('ogimet_retries_total', reason=reason)
+                metrics.inc('ogimet_retry_sleep_seconds_total', delay)
+                time.sleep(delay)
+            try:
+                clean_data, raw_data = self.get_weather_data(station, year, month, report_type, end_day, since)
+                if since:
+                    new_reports = len(clean_data.split('\n')) if clean_data else 0
+                    print(f"{label} 🔄 Delta since day {since[0]} {since[1]}:{since[2]}: {new_reports} new reports")
+                    clean_data = self.merge_reports(base, clean_data)
+                
+                if clean_data and len(clean_data.strip()) > 0:
+                    print(f"{label} ✅ Success")
+                    self.cache_clean_data(station, report_type, year, month, end_day, clean_data)
+                    return clean_data, raw_data
+                
+                # Upstream says there are no reports - asking again will not change that
+                print(f"{label} 📭 No reports")
+                negative_cache.mark_month(station, report_type, year, month)
+                return "", "No reports"
+            
+            except UnknownStation as e:
+                print(f"{label} ❓ {e}")
+                negative_cache.mark_station(station)
+                return "", str(e)
+            
+            except UpstreamUnavailable:
+                # Retrying cannot help until the breaker lets probes through
+                print(f"{label} 🚧 Upstream unavailable")
+                reason = 'upstream unavailable'
+                break
+            
+            except UpstreamThrottled:
+                print(f"{label} 🐢 Quota page")
+                reason = 'throttled'
+            
+            except MalformedResponse:
+                print(f"{label} 🧩 Unrecognized response")
+                reason = 'malformed response'
+            
+            except requests.exceptions.Timeout:
+                print(f"{label} ⌛ Timeout")
+                reason = 'timeout'
+            
+            except requests.exceptions.ConnectionError:
+                print(f"{label} 🔌 Connection error")
+                reason = 'connection error'
+            
+            except Exception as e:
+                print(f"{label} ⚠️ Error: {str(e)[:30]}")
+                reason = 'error'
+        
+        # An expired copy is better than nothing while upstream is failing
+        stale = response_cache.get(station, report_type, year, month, end_day, stale_ok=True)
+        if stale:
+            print(f"    {station} {year}-{month}: 🧊 Serving stale data ({reason})")
+            return stale, f"Stale: {reason}"
+        return "", "All retries failed"
+
+    def get_weather_data(self, station, year, month, report_type='METAR', end_day=None, since=None):
+        """Get METAR or TAF data with original cleaning
+
+        Returns (clean_data, start of the raw body); clean_data is empty only
+        for a genuine "no reports" page. Quota pages raise UpstreamThrottled,
+        unknown stations UnknownStation and anything unrecognized
+        MalformedResponse.
+        """
+        if not end_day:
+            month_days = {
+                '01': '31', '02': '28', '03': '31', '04': '30',
+                '05': '31', '06': '30', '07': '31', '08': '31',
+                '09': '30', '10': '31', '11': '30', '12': '31'
+            }
+            
+            if month == '02' and int(year) % 4 == 0:
+                end_day = '29'
+            else:
+                end_day = month_days.get(month, '31')
+        
+        # since=(day, hour, minute) asks only for the end of the month (delta sync)
+        form_data = self.build_form_data(
+            station, report_type, (year, month, *(since or ('01', '00', '00'))), (year, month, end_day, '23', '59')
+        )
+        
+        # Raw lines are only kept when a debug dump may be written
+        debug = debug_dumps.wants()
+        raw = [] if debug else None
+        head = []
+        clean_data = ''
+        read_time = [0.0]
+        try:
+            # Shared keep-alive session - no new handshake or cookie round trip.
+            # The body is cleaned while it downloads instead of after .text
+            response = upstream.post(form_data, timeout=90, stream=True)
+            started = time.perf_counter()
+            with response:
+                def raw_lines():
+                    for line in iter_response_lines(response, read_time=read_time):
+                        if len(head) < 200:
+                            head.append(line)
+                        if raw is not None:
+                            raw.append(line)
+                        yield line
+                
+                # Apply cleaning based on report type
+                reports = sorted(self.iter_reports(raw_lines(), report_type), key=itemgetter(0))
+            metrics.observe('ogimet_parse_seconds', time.perf_counter() - started - read_time[0], type=report_type)
+            
+            raw_data = '\n'.join(head)
+            if response.ok:
+                # request() has already slowed down for a 429 or 5xx
+                upstream.settle(raw_data)
+            # Anything but data or a genuine "no reports" page is raised for the caller to act on
+            kind = upstream.classify(response.status_code, raw_data, len(reports))
+            metrics.inc('ogimet_upstream_responses_total', kind=kind)
+            if kind == 'throttled':
+                raise UpstreamThrottled(f"Upstream quota page ({response.status_code})")
+            if kind == 'unknown-station':
+                raise UnknownStation(f"Unknown station {station}")
+            if kind == 'malformed':
+                raise MalformedResponse(f"Unrecognized upstream response ({response.status_code})")
+            clean_data = '\n'.join(report for _, report in reports)
+            return clean_data, raw_data
+            
+        except Exception as e:
+            print(f"  Request error: {e}")
+            if raw is not None:
+                raw.append(f"<!-- Request error: {e} -->")
+            raise
+        
+        finally:
+            if debug == 'always' or (debug == 'error' and not clean_data):
+                debug_dumps.capture(f"debug_{report_type}_{station}_{year}{month}.html", '\n'.join(raw))
+                debug_dumps.capture(f"debug_clean_{report_type}_{station}_{year}{month}.txt", clean_data)
+
+    def build_form_data(self, station, report_type, start, end):
+        """Ogimet query form for start..end, each a (year, month, day, hour, minute) tuple"""
+        # Set report type (METAR=SA, TAF=FC)
+        tipo = 'FC' if report_type == 'TAF' else 'SA'
+        
+        return {
+            'lugar': station,
+            'tipo': tipo,
+            'ord': 'DIR',
+            'nil': 'NO',
+            'fmt': 'txt',
+            'ano': start[0],
+            'mes': start[1],
+            'day': start[2],
+            'hora': start[3],
+            'min': start[4],
+            'anof': end[0],
+            'mesf': end[1],
+            'dayf': end[2],
+            'horaf': end[3],
+            'minf': end[4],
+            'send': 'send',
+            'enviar': 'Send',
+            'lang': 'en'
+        }
+
+    def fetch_month_range(self, station, report_type, months):
+        """Fetch consecutive (year, month) pairs in as few upstream requests as possible
+
+        Each request asks for a window of up to RANGE_MONTHS months and the
+        reports are split back into months locally by their timestamp prefix,
+        straight into the on-disk cache. If upstream rejects a window or cuts
+        the body short, the window is halved and the rest is asked for again;
+        it grows back after each complete response. Months after the last
+        one with reports in a complete body (or a real "no reports" page)
+        have no reports. Returns {(year, month): report count} for every
+        month a complete response covered (0 if it had no reports); months
+        that could not be fetched are left out.
+        """
+        covered = {}
+        window = RANGE_MONTHS
+        i = 0
+        while i < len(months):
+            span = months[i:i + window]
+            try:
+                writers, seen, kind, complete = self.stream_month_range(station, report_type, span)
+            except (UpstreamUnavailable, UnknownStation) as e:
+                print(f"  Range request skipped: {e}")
+                if isinstance(e, UnknownStation):
+                    negative_cache.mark_station(station)
+                break
+            except Exception as e:
+                print(f"  Range request error: {e}")
+                writers, seen, kind, complete = None, set(), None, False
+            seen = [ym for ym in span if ym in seen]
+            
+            if seen and not complete:
+                # Cut short: the last month we saw may be partial, so keep only
+                # the months before it and ask again from there
+                span = span[:span.index(seen[-1])]
+                if not span:
+                    # Cut off inside its first month - only that month on its own can help
+                    for writer in writers.values():
+                        writer.discard()
+                    if window == 1:
+                        break
+                    window = 1
+                    continue
+            
+            if writers is None or (not seen and kind != 'empty'):
+                # Rejected - try a narrower window
+                for writer in (writers or {}).values():
+                    writer.discard()
+                if window == 1:
+                    break
+                window = max(1, window // 2)
+                continue
+            
+            if complete or kind == 'empty':
+                window = min(RANGE_MONTHS, window * 2)
+            else:
+                window = max(1, window // 2)
+            
+            for ym in span:
+                writer = writers.pop(ym, None)
+                covered[ym] = writer.commit() if writer else 0
+                if covered[ym]:
+                    negative_cache.clear_month(station, report_type, *ym)
+                else:
+                    negative_cache.mark_month(station, report_type, *ym)
+                # The memory copy (if any) is older than what was just written
+                clean_cache.discard((station, report_type, *ym, month_end_day(*ym)))
+            for writer in writers.values():
+                writer.discard()
+            i += len(span)
+        
+        print(f"  🧩 Range fetch {station} {months[0][0]}-{months[0][1]}..{months[-1][0]}-{months[-1][1]}: "
+              f"{len(covered)}/{len(months)} months")
+        return covered
+
+    def stream_month_range(self, station, report_type, span):
+        """POST one range query and clean the body into per-month files as it downloads
+
+        Upstream sends reports in time order, so each month arrives as one run
+        of lines and only one month's reports are being handled at a time.
+        Returns (writers, seen, kind, complete): a finished ReportWriter for
+        each month that produced reports, the months upstream sent any report
+        line for, how the response was classified and whether the body ended
+        normally (a closing </pre> after the last report). writers is None if
+        upstream refused or throttled the request.
+        """
+        form_data = self.build_form_data(
+            station, report_type,
+            (span[0][0], span[0][1], '01', '00', '00'),
+            (span[-1][0], span[-1][1], month_end_day(*span[-1]), '23', '59')
+        )
+        wanted = set(span)
+        writers = {}
+        seen = set()
+        head = []
+        tail = deque(maxlen=50)
+        read_time = [0.0]
+        try:
+            with upstream.post(form_data, timeout=180, stream=True) as response:
+                if not response.ok:
+                    metrics.inc('ogimet_upstream_responses_total', kind='malformed')
+                    return None, seen, 'malformed', False
+                status_code = response.status_code
+                started = time.perf_counter()
+                tagged = tag_lines_by_month(iter_response_lines(response, read_time=read_time), head, tail)
+                for ym, group in itertools.groupby(tagged, key=itemgetter(0)):
+                    if ym is None:
+                        continue
+                    seen.add(ym)
+                    if ym not in wanted:
+                        continue
+                    writer = writers.get(ym)
+                    if writer is None:
+                        writer = writers[ym] = ReportWriter(
+                            response_cache.path(station, report_type, *ym, month_end_day(*ym))
+                        )
+                    for key, report in self.iter_reports((line for _, line in group), report_type):
+                        writer.write(key, report)
+            for writer in writers.values():
+                writer.finish()
+            metrics.observe('ogimet_parse_seconds', time.perf_counter() - started - read_time[0], type=report_type)
+        except BaseException:
+            for writer in writers.values():
+                writer.discard()
+            raise
+        
+        head_text = '\n'.join(head)
+        upstream.settle(head_text)
+        kind = upstream.classify(status_code, head_text, len(seen))
+        metrics.inc('ogimet_upstream_responses_total', kind=kind)
+        if kind in ('throttled', 'malformed', 'unknown-station'):
+            for writer in writers.values():
+                writer.discard()
+            if kind == 'unknown-station':
+                raise UnknownStation(f"Unknown station {station}")
+            return None, set(), kind, False
+        
+        # Months whose lines held no valid report are covered but empty
+        for ym in [ym for ym, writer in writers.items() if not writer.count]:
+            writers.pop(ym).discard()
+        closing = [n for n, line in enumerate(tail) if '</pre>' in line.lower()]
+        last_report = max((n for n, line in enumerate(tail) if MONTH_PREFIX_RE.match(line)), default=-1)
+        complete = bool(closing) and closing[-1] >= last_report
+        return writers, seen, kind, complete
+
+    def clean_text(self, text, report_type):
+        """Apply the METAR or TAF cleaner"""
+        if report_type == 'TAF':
+            return self.clean_taf_text_original(text)
+        return self.clean_metar_text_original(text)
+
+    def clean_metar_text_original(self, text):
+        """ORIGINAL METAR cleaning - remove timestamps"""
+        reports = list(self.iter_metar_reports(text.split('\n')))
+        
+        # Sort by time (stable, like the original)
+        reports.sort(key=itemgetter(0))
+        
+        return '\n'.join(report for _, report in reports)
+
+    def iter_metar_reports(self, lines):
+        """Yield (sort key, clean METAR) for each report as soon as its line is seen
+
+        Single pass with precompiled patterns: the sort key comes out of the
+        same scan that validates the report.
+        """
+        for line in lines:
+            line = line.strip()
+            
+            # Skip blanks and HTML/comments
+            if not line or line[0] in '<#':
+                continue
+            
+            # Only process METAR/SPECI lines
+            if 'METAR' not in line and 'SPECI' not in line:
+                continue
+            
+            # Remove timestamps - KEY FEATURE!
+            prefix = METAR_TIMESTAMP_RE.match(line)
+            if prefix:
+                line = line[prefix.end():]
+            elif '->' in line:
+                line = line.split('->', 1)[1]
+            
+            line = ' '.join(line.split())
+            
+            # Validate it's a proper METAR
+            if len(line) > 20:
+                time_match = REPORT_TIME_RE.search(line)
+                if time_match:
+                    yield time_match.group(1), line
+
+    def clean_taf_text_original(self, text):
+        """ORIGINAL TAF cleaning"""
+        clean_tafs = list(self.iter_taf_reports(text.split('\n')))
+        
+        # Sort by time (extract from TAF line)
+        clean_tafs.sort(key=itemgetter(0))
+        
+        return '\n'.join(taf for _, taf in clean_tafs)
+
+    def iter_taf_reports(self, lines):
+        """Yield (sort key, clean TAF) for each TAF once its last line has been seen"""
+        current_taf = []
+        in_taf = False
+        
+        for line in lines:
+            line = line.rstrip()  # Only remove trailing spaces
+            
+            if not line:
+                continue
+            
+            # Skip HTML/comments
+            if line.startswith(('<', '#', '<!--')):
+                continue
+            
+            # Check if this is a TAF line (timestamp followed by TAF)
+            if TAF_START_RE.match(line):
+                # Save previous TAF if exists
+                if current_taf:
+                    clean_taf = self.process_taf_lines(current_taf)
+                    if clean_taf:
+                        yield report_sort_key(clean_taf), clean_taf
+                    current_taf = []
+                
+                # Start new TAF - REMOVE leading timestamp
+                clean_line = TAF_TIMESTAMP_RE.sub('', line, count=1)
+                current_taf.append(clean_line)
+                in_taf = True
+            
+            # If we're in a TAF and line continues it
+            elif in_taf and (line.startswith(' ') or line.startswith('\t') or 
+                            line.startswith('BECMG') or line.startswith('TEMPO') or 
+                            line.startswith('FM') or line.startswith('PROB')):
+                # Check if this is a continuation of current TAF
+                current_taf.append(line.strip())
+            
+            # If line doesn't continue TAF
+            elif in_taf and not (line.startswith(' ') or line.startswith('\t')):
+                # End current TAF
+                if current_taf:
+                    clean_taf = self.process_taf_lines(current_taf)
+                    if clean_taf:
+                        yield report_sort_key(clean_taf), clean_taf
+                    current_taf = []
+                in_taf = False
+        
+        # Add last TAF if exists
+        if current_taf:
+            clean_taf = self.process_taf_lines(current_taf)
+            if clean_taf:
+                yield report_sort_key(clean_taf), clean_taf
+
+    def iter_reports(self, lines, report_type):
+        """Generator-based METAR or TAF cleaner over an iterable of raw lines"""
+        if report_type == 'TAF':
+            return self.iter_taf_reports(lines)
+        return self.iter_metar_reports(lines)
+
+    def process_taf_lines(self, taf_lines):
+        """Process and clean TAF lines"""
+        if not taf_lines:
+            return ""
+        
+        # Join lines with single space
+        clean_taf = ' '.join(taf_lines)
+        
+        # Remove extra spaces
+        clean_taf = re.sub(r'\s+', ' ', clean_taf)
+        
+        # Ensure proper format
+        if 'TAF' in clean_taf and re.search(r'\d{6}Z', clean_taf):
+            return clean_taf
+        return ""
+
+
+downloader = MetarDownloader()
+
+
+class Job:
+    """Common state of a background job, plus an append-only event log
+
+    Events are numbered from 1 so streaming clients can resume with
+    Last-Event-ID after a reconnect.
+    """
+    kind = 'job'
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.status = 'queued'
+        self.error = ''
+        self.result = None
+        self.created = time.time()
+        self.finished = None
+        self.lock = threading.Condition()
+        self.events = []
+
+    def add_event(self, event, **data):
+        with self.lock:
+            self.events.append({'id': len(self.events) + 1, 'event': event, 'data': data})
+            self.lock.notify_all()
+
+    def finish(self, status, error=''):
+        self.error = error
+        self.status = status
+        self.finished = time.time()
+        self.add_event(f"job_{status}", error=error, result_url=f"/job/{self.id}")
+
+    def events_after(self, last_id, timeout=None):
+        """Events newer than last_id, waiting up to timeout for one to arrive"""
+        with self.lock:
+            if len(self.events) <= last_id and not self.finished:
+                self.lock.wait(timeout)
+            return self.events[last_id:]
+
+
+class BatchJob(Job):
+    """Background download of all 12 months for one station/year"""
+    kind = 'batch'
+
+    def __init__(self, station, year, report_type):
+        super().__init__((self.kind, station, year, report_type))
+        self.station = station
+        self.year = year
+        self.report_type = report_type
+        self.months = [
+            {'month': month, 'month_name': name, 'status': 'pending', 'reports': 0, 'error': '', 'retries': 0}
+            for month, name in MONTH_NAMES.items()
+        ]
+
+    def update_month(self, month, status, reports=0, error=''):
+        event = {'running': 'month_start', 'retrying': 'month_retry',
+                 'done': 'month_success', 'failed': 'month_failed'}[status]
+        with self.lock:
+            entry = self.months[int(month) - 1]
+            if status == 'retrying':
+                entry['retries'] += 1
+            else:
+                entry['status'] = status
+                entry['reports'] = reports
+                entry['error'] = error
+            data = dict(entry)
+        data['error'] = error
+        self.add_event(event, **data)
+
+    def execute(self):
+        return downloader.download_all_months(
+            self.station, self.year, self.report_type, progress=self.update_month
+        )
+
+    def snapshot(self):
+        """JSON-friendly copy of the job state"""
+        with self.lock:
+            months = [dict(m) for m in self.months]
+            last_event_id = len(self.events)
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'station': self.station,
+            'year': self.year,
+            'report_type': self.report_type,
+            'status': self.status,
+            'error': self.error,
+            'months': months,
+            'done': sum(1 for m in months if m['status'] == 'done'),
+            'failed': sum(1 for m in months if m['status'] == 'failed'),
+            'total_reports': sum(m['reports'] for m in months),
+            'last_event_id': last_event_id,
+            'result_url': f"/job/{self.id}",
+        }
+
+
+class BulkJob(Job):
+    """Background download of many stations over a range of years"""
+    kind = 'bulk'
+
+    def __init__(self, stations, start_year, end_year, report_type):
+        super().__init__((self.kind, tuple(stations), start_year, end_year, report_type))
+        self.stations = stations
+        self.start_year = start_year
+        self.end_year = end_year
+        self.report_type = report_type
+        self.folder = f"{report_type}_BULK_{start_year}-{end_year}_{self.id}"
+        self.months_per_station = (int(end_year) - int(start_year) + 1) * 12
+        self.progress = {station: {'done': 0, 'failed': 0, 'reports': 0} for station in stations}
+
+    def update_station(self, station, status, reports=0, error=''):
+        with self.lock:
+            entry = self.progress[station]
+            entry[status] += 1
+            entry['reports'] += reports
+            data = dict(entry)
+        self.add_event('unit_success' if status == 'done' else 'unit_failed',
+                       station=station, error=error, **data)
+
+    def execute(self):
+        return downloader.download_bulk(
+            self.stations, self.start_year, self.end_year, self.report_type,
+            self.folder, progress=self.update_station
+        )
+
+    def snapshot(self):
+        """JSON-friendly copy of the job state"""
+        with self.lock:
+            stations = [dict(station=station, total=self.months_per_station, **entry)
+                        for station, entry in self.progress.items()]
+            last_event_id = len(self.events)
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'stations': stations,
+            'start_year': self.start_year,
+            'end_year': self.end_year,
+            'report_type': self.report_type,
+            'status': self.status,
+            'error': self.error,
+            'folder': self.folder,
+            'total': self.months_per_station * len(stations),
+            'done': sum(s['done'] for s in stations),
+            'failed': sum(s['failed'] for s in stations),
+            'total_reports': sum(s['reports'] for s in stations),
+            'last_event_id': last_event_id,
+            'result_url': f"/job/{self.id}",
+        }
+
+
+class JobManager:
+    """Run download jobs on a small thread pool, independent of the HTTP request"""
+    def __init__(self, max_workers=JOB_WORKERS, ttl=JOB_TTL):
+        self.ttl = ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.pool = DaemonThreadPool(max_workers=max_workers, thread_name_prefix='metar-job')
+
+    def submit(self, job):
+        """Queue a job, reusing an unfinished one for the same request"""
+        with self.lock:
+            self.prune()
+            for existing in self.jobs.values():
+                if existing.key == job.key and existing.status in ('queued', 'running'):
+                    return existing
+            self.jobs[job.id] = job
+        self.pool.submit(self.run, job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def run(self, job):
+        job.status = 'running'
+        job.add_event('job_start')
+        try:
+            job.result = job.execute()
+            job.finish('done')
+        except Exception as e:
+            print(f"❌ Job {job.id} failed: {e}")
+            job.finish('failed', str(e))
+
+    def busy(self):
+        """True while any job is queued or running"""
+        with self.lock:
+            return any(job.status in ('queued', 'running') for job in self.jobs.values())
+
+    def prune(self):
+        """Forget finished jobs older than the TTL (caller holds the lock)"""
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished and now - job.finished > self.ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+
+jobs = JobManager()
+
+
+class WatchlistPrefetcher:
+    """Keeps the current and previous month of watched stations warm in the caches
+
+    Every `interval` seconds it refreshes each station/type whose entries are
+    missing or would go stale before the next round (open months by delta
+    sync). It waits for a quiet spell - no user request for `quiet` seconds
+    and no job running, or at most one interval - and pauses between
+    fetches so users keep most of the shared upstream rate.
+    """
+    def __init__(self, stations=WATCHLIST, report_types=WATCH_TYPES, interval=WATCH_INTERVAL,
+                 quiet=WATCH_QUIET, pause=WATCH_PAUSE):
+        self.stations = [s.strip().upper() for s in stations.split(',') if STATION_RE.fullmatch(s.strip().upper())]
+        self.report_types = [t.strip().upper() for t in report_types.split(',') if t.strip().upper() in REPORT_TYPES]
+        self.interval = interval
+        self.quiet = quiet
+        self.pause = pause
+        self.last_activity = 0.0
+        self.thread = None
+
+    def note_activity(self):
+        """Called for every user request"""
+        self.last_activity = time.time()
+
+    def is_quiet(self):
+        return time.time() - self.last_activity >= self.quiet and not jobs.busy()
+
+    def start(self):
+        if not self.stations or self.thread:
+            return
+        self.thread = threading.Thread(target=self.run, name='watchlist', daemon=True)
+        self.thread.start()
+        print(f"👀 Watching {', '.join(self.stations)} ({', '.join(self.report_types)}) every {self.interval}s")
+
+    def run(self):
+        while True:
+            started = time.time()
+            try:
+                self.refresh_round()
+            except Exception as e:
+                print(f"⚠️ Watchlist refresh failed: {e}")
+            time.sleep(max(0.0, self.interval - (time.time() - started)))
+
+    def due(self):
+        """(station, report_type, year, month) that need fetching this round"""
+        now = datetime.utcnow()
+        previous = now.replace(day=1) - timedelta(days=1)
+        months = [(f"{previous.year}", f"{previous.month:02d}"), (f"{now.year}", f"{now.month:02d}")]
+        return [(station, report_type, year, month)
+                for station in self.stations for report_type in self.report_types for year, month in months
+                if response_cache.expires_within(station, report_type, year, month,
+                                                 month_end_day(year, month), self.interval)
+                and not negative_cache.month_is_empty(station, report_type, year, month)]
+
+    def refresh_round(self):
+        due = self.due()
+        if not due:
+            return
+        deadline = time.time() + self.interval
+        for n, (station, report_type, year, month) in enumerate(due):
+            while not self.is_quiet() and time.time() < deadline:
+                time.sleep(1)
+            if n:
+                time.sleep(self.pause)
+            print(f"👀 Prefetch {report_type} {station} {year}-{month}")
+            downloader.get_weather_data_with_retry(station, year, month, report_type, retries=1, refresh=True)
+
+
+prefetcher = WatchlistPrefetcher()
+
+
+class MetarHandler(MetarDownloader, http.server.SimpleHTTPRequestHandler):
+    # Route label values for metrics; anything else is counted as 'other'
+    METRIC_ROUTES = ('download', 'file', 'batch', 'bulk', 'job', 'decoded', 'query')
 
-class MetarHandler(http.server.SimpleHTTPRequestHandler):
     def do_GET(self):
+        if self.path == '/metrics':
+            # Scrapes are not user activity and are not logged
+            self.process_metrics_request()
+            return
         print(f"Request: {self.path}")
+        prefetcher.note_activity()
+        route = self.path.split('?')[0].strip('/').split('/')[0]
+        if self.path == '/':
+            route = 'home'
+        elif route not in self.METRIC_ROUTES:
+            route = 'other'
+        with metrics.timer('ogimet_http_request_seconds', route=route):
+            self.route_request()
+
+    def route_request(self):
         if self.path == '/':
             self.home_page()
         elif self.path.startswith('/download?'):
@@ -20,6 +2517,14 @@ class MetarHandler(http.server.SimpleHTTPRequestHandler):
             self.send_file()
         elif self.path.startswith('/batch?'):
             self.process_batch_request()
+        elif self.path.startswith('/bulk?'):
+            self.process_bulk_request()
+        elif self.path.startswith('/job/'):
+            self.process_job_request()
+        elif self.path.startswith('/decoded?'):
+            self.process_decoded_request()
+        elif self.path.startswith('/query?'):
+            self.process_query_request()
         else:
             self.send_error(404, f"Not found: {self.path}")
 
@@ -265,6 +2770,19 @@ class MetarHandler(http.server.SimpleHTTPRequestHandler):
                     animation: spin 1s linear infinite;
                     margin: 0 auto 20px;
                 }
+                .month-progress {
+                    margin-top: 20px;
+                    text-align: left;
+                    display: grid;
+                    grid-template-columns: repeat(3, 1fr);
+                    gap: 10px;
+                }
+                .month-row {
+                    background: #f8f9fa;
+                    padding: 10px;
+                    border-radius: 8px;
+                    font-size: 0.9rem;
+                }
                 @keyframes spin {
                     0% { transform: rotate(0deg); }
                     100% { transform: rotate(360deg); }
@@ -390,6 +2908,7 @@ class MetarHandler(http.server.SimpleHTTPRequestHandler):
                     <div class="spinner"></div>
                     <h3>Downloading Data...</h3>
                     <p id="statusText">Please wait while we process your request</p>
+                    <div id="monthProgress" class="month-progress"></div>
                 </div>
                 
                 <!-- Status Bar -->
@@ -453,6 +2972,7 @@ class MetarHandler(http.server.SimpleHTTPRequestHandler):
                     
                     // Show loading
                     document.getElementById('loading').style.display = 'block';
+                    document.querySelector('#loading .spinner').style.display = '';
                     document.querySelector('form').style.display = 'none';
                     
                     // Update status
@@ -470,14 +2990,74 @@ class MetarHandler(http.server.SimpleHTTPRequestHandler):
                         statusText.textContent = `Downloading ${reportType} ${station} ${monthName} ${year}...`;
                     }
                     
-                    // Redirect to download page
+                    // Batch: start the job and follow its progress live; single month: redirect
                     if (mode === 'all') {
-                        window.location.href = `/batch?station=${station}&year=${year}&type=${reportType}`;
+                        const batchUrl = `/batch?station=${station}&year=${year}&type=${reportType}`;
+                        // Asking for JSON gets the job id back instead of a redirect to the job page
+                        fetch(batchUrl, { headers: { 'Accept': 'application/json' } })
+                            .then(response => {
+                                const jobId = response.headers.get('X-Job-Id');
+                                if (!response.ok || !jobId) {
+                                    showError(`Download failed: ${response.statusText || response.status}`);
+                                    return;
+                                }
+                                followJob(`/job/${jobId}`);
+                            })
+                            .catch(() => { window.location.href = batchUrl; });
                     } else {
                         window.location.href = `/download?station=${station}&year=${year}&month=${month}&type=${reportType}`;
                     }
                 }
                 
+                function showError(message) {
+                    document.querySelector('#loading .spinner').style.display = 'none';
+                    document.getElementById('statusText').textContent = message;
+                    document.querySelector('form').style.display = '';
+                }
+                
+                function followJob(jobUrl) {
+                    const statusText = document.getElementById('statusText');
+                    // EventSource reconnects on its own and resumes from Last-Event-ID
+                    const source = new EventSource(`${jobUrl}/events`);
+                    
+                    source.addEventListener('month_start', e => {
+                        const data = JSON.parse(e.data);
+                        renderMonth(data, '⏳ downloading...');
+                        statusText.textContent = `Downloading ${data.month_name}...`;
+                    });
+                    source.addEventListener('month_retry', e => {
+                        const data = JSON.parse(e.data);
+                        renderMonth(data, `🔁 retrying (${data.error})`);
+                    });
+                    source.addEventListener('month_success', e => {
+                        const data = JSON.parse(e.data);
+                        renderMonth(data, `✅ ${data.reports} reports`);
+                    });
+                    source.addEventListener('month_failed', e => {
+                        const data = JSON.parse(e.data);
+                        renderMonth(data, `❌ ${data.error || 'failed'}`);
+                    });
+                    source.addEventListener('job_done', () => {
+                        source.close();
+                        window.location.href = jobUrl;
+                    });
+                    source.addEventListener('job_failed', e => {
+                        source.close();
+                        statusText.textContent = `Download failed: ${JSON.parse(e.data).error}`;
+                    });
+                }
+                
+                function renderMonth(data, text) {
+                    let row = document.getElementById(`month-${data.month}`);
+                    if (!row) {
+                        row = document.createElement('div');
+                        row.id = `month-${data.month}`;
+                        row.className = 'month-row';
+                        document.getElementById('monthProgress').appendChild(row);
+                    }
+                    row.textContent = `${data.month_name}: ${text}`;
+                }
+                
                 function resetForm() {
                     document.getElementById('reportType').value = 'METAR';
                     document.getElementById('station').value = 'VOGA';
@@ -516,455 +3096,319 @@ class MetarHandler(http.server.SimpleHTTPRequestHandler):
         year = params.get('year', ['2024'])[0]
         month = params.get('month', ['01'])[0]
         report_type = params.get('type', ['METAR'])[0].upper()
+        try:
+            check_target(station, report_type, year, month)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
         
         print(f"{report_type} download: {station} {year}-{month}")
         
         # Download data
         result = self.download_single_month(station, year, month, report_type)
         
-        # Show result
+        # Show result - successful pages are reused until the data changes
+        page_key = None
+        html = None
+        if result['success']:
+            page_key = (station, year, month, report_type, result['filename'], hash(result['clean_data']))
+            html = page_cache.get(page_key)
+        if html is None:
+            with metrics.timer('ogimet_render_seconds', page='single'):
+                html = self.create_single_result_page(result, station, year, month, report_type)
+            if page_key:
+                page_cache.put(page_key, html)
         self.send_response(200)
         self.send_header('Content-type', 'text/html; charset=utf-8')
         self.end_headers()
-        html = self.create_single_result_page(result, station, year, month, report_type)
         self.wfile.write(html.encode('utf-8'))
 
     def process_batch_request(self):
-        """Handle all months download"""
+        """Queue an all-months download and redirect to its job page
+
+        A client that accepts JSON gets 202 with the job id instead, so it
+        does not have to load the job page to find it.
+        """
         query = self.path.split('?')[1] if '?' in self.path else ''
         params = urllib.parse.parse_qs(query)
         station = params.get('station', ['VOGA'])[0].upper()
         year = params.get('year', ['2024'])[0]
         report_type = params.get('type', ['METAR'])[0].upper()
+        try:
+            check_target(station, report_type, year)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
         
         print(f"Batch {report_type} download: {station} {year} (all months)")
         
-        # Start batch download
-        results = self.download_all_months(station, year, report_type)
+        # Run the download in the background so the request returns at once
+        job = jobs.submit(BatchJob(station, year, report_type))
         
-        # Show result
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
+        if 'application/json' in self.headers.get('Accept', ''):
+            body = json.dumps({'id': job.id, 'url': f"/job/{job.id}"}).encode('utf-8')
+            self.send_response(202)
+            self.send_header('Content-type', 'application/json')
+        else:
+            body = b''
+            self.send_response(303)
+        self.send_header('Location', f"/job/{job.id}")
+        self.send_header('X-Job-Id', job.id)
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        html = self.create_batch_result_page(results, station, year, report_type)
-        self.wfile.write(html.encode('utf-8'))
+        self.wfile.write(body)
 
-    def download_single_month(self, station, year, month, report_type):
-        """Download single month with original cleaning"""
-        result = {
-            'success': False,
-            'filename': '',
-            'reports': 0,
-            'error': '',
-            'raw_data': '',
-            'clean_data': '',
-            'report_type': report_type
-        }
-        
+    def stream_job_events(self, job):
+        """Push job events as Server-Sent Events for up to EVENT_STREAM_SECONDS
+
+        The stream is closed after that so it does not hold a request worker
+        for the whole job. The EventSource reconnects with Last-Event-ID and
+        picks up right after the last event it saw (?last_event_id= works as
+        well).
+        """
+        query = self.path.split('?')[1] if '?' in self.path else ''
+        params = urllib.parse.parse_qs(query)
         try:
-            print(f"Downloading {report_type} {station} {year}-{month}...")
-            
-            # Get data with original cleaning
-            clean_data, raw_data = self.get_weather_data_with_retry(station, year, month, report_type)
-            
-            if clean_data and len(clean_data.strip()) > 0:
-                # Save file with CORRECT naming (original format)
-                if report_type == 'METAR':
-                    filename = f"METAR{year}{month}.txt"
-                else:  # TAF
-                    filename = f"TAF{year}{month}.txt"
-                
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(clean_data)
-                
-                # Count reports - count each TAF issuance
-                if report_type == 'TAF':
-                    # Count TAF lines (lines starting with TAF)
-                    lines = clean_data.strip().split('\n')
-                    report_count = len([l for l in lines if l.strip() and 'TAF' in l])
-                else:
-                    lines = clean_data.strip().split('\n')
-                    report_count = len([l for l in lines if l.strip()])
-                
-                result['success'] = True
-                result['filename'] = filename
-                result['reports'] = report_count
-                result['raw_data'] = raw_data
-                result['clean_data'] = clean_data
-                
-                print(f"✅ Saved {report_count} {report_type} reports to {filename}")
-            else:
-                result['error'] = f"No {report_type} data found"
-                print(f"❌ No {report_type} data found")
-                
-        except Exception as e:
-            result['error'] = str(e)
-            print(f"❌ Exception: {e}")
+            last_id = int(self.headers.get('Last-Event-ID') or params.get('last_event_id', ['0'])[0])
+        except ValueError:
+            last_id = 0
         
-        return result
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.end_headers()
+        try:
+            self.wfile.write(b"retry: 3000\n\n")
+            deadline = time.monotonic() + EVENT_STREAM_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                events = job.events_after(last_id, timeout=min(15, remaining))
+                if not events:
+                    if job.finished:
+                        break
+                    # Comment line keeps proxies from timing out an idle stream
+                    self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+                    continue
+                for event in events:
+                    message = f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+                    self.wfile.write(message.encode('utf-8'))
+                    last_id = event['id']
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away - the job itself keeps running
+            pass
 
-    def download_all_months(self, station, year, report_type):
-        """Download all 12 months in batches with improved reliability"""
-        results = []
-        file_prefix = 'METAR' if report_type == 'METAR' else 'TAF'
-        folder_name = f"{file_prefix}_{station}_{year}"
-        os.makedirs(folder_name, exist_ok=True)
-        
-        month_days = {
-            '01': '31', '02': '28', '03': '31', '04': '30',
-            '05': '31', '06': '30', '07': '31', '08': '31',
-            '09': '30', '10': '31', '11': '30', '12': '31'
-        }
-        
-        month_names = {
-            '01': 'January', '02': 'February', '03': 'March', '04': 'April',
-            '05': 'May', '06': 'June', '07': 'July', '08': 'August',
-            '09': 'September', '10': 'October', '11': 'November', '12': 'December'
-        }
-        
-        is_leap = int(year) % 4 == 0
-        
-        # Process in smaller batches (2 months at a time) for better reliability
-        all_months = list(range(1, 13))
-        batches = [all_months[i:i+2] for i in range(0, len(all_months), 2)]
+    def process_bulk_request(self):
+        """Queue a multi-station, multi-year download and redirect to its job page"""
+        query = self.path.split('?')[1] if '?' in self.path else ''
+        params = urllib.parse.parse_qs(query)
+        stations = []
+        for value in params.get('stations', params.get('station', [])):
+            for station in value.upper().replace(' ', ',').split(','):
+                if station and station not in stations:
+                    stations.append(station)
+        report_type = params.get('type', ['METAR'])[0].upper()
+        try:
+            start_year = int(params.get('start_year', ['2024'])[0])
+            end_year = int(params.get('end_year', [str(start_year)])[0])
+        except ValueError:
+            self.send_error(400, "start_year and end_year must be numbers")
+            return
         
-        print(f"\n🚀 Starting {report_type} batch download for {station} {year}")
-        print(f"📁 Saving to folder: {folder_name}")
+        if not stations or not all(STATION_RE.fullmatch(s) for s in stations):
+            self.send_error(400, "stations must be a comma-separated list of 4-letter ICAO codes")
+            return
+        if report_type not in REPORT_TYPES:
+            self.send_error(400, "type must be METAR or TAF")
+            return
+        if not all(YEAR_RE.fullmatch(str(year)) for year in (start_year, end_year)):
+            self.send_error(400, "start_year and end_year must be four-digit years")
+            return
+        if end_year < start_year:
+            self.send_error(400, "end_year is before start_year")
+            return
+        if len(stations) * (end_year - start_year + 1) * 12 > BULK_MAX_MONTHS:
+            self.send_error(400, f"Too much for one job (limit: {BULK_MAX_MONTHS} station-months)")
+            return
         
-        for batch_idx, batch in enumerate(batches):
-            print(f"\n📦 Batch {batch_idx + 1}/{len(batches)}")
-            
-            for month_num in batch:
-                month = f"{month_num:02d}"
-                month_name = month_names.get(month, f"Month {month}")
-                
-                if month == '02' and is_leap:
-                    end_day = '29'
-                else:
-                    end_day = month_days.get(month, '31')
-                
-                print(f"  📅 {month_name} ({year}-{month})...", end="", flush=True)
-                
-                try:
-                    # Get data with retry logic
-                    clean_data, _ = self.get_weather_data_with_retry(
-                        station, year, month, report_type, end_day
-                    )
-                    
-                    if clean_data and len(clean_data.strip()) > 0:
-                        # CORRECT file naming (original format)
-                        filename = os.path.join(folder_name, f"{file_prefix}{year}{month}.txt")
-                        
-                        with open(filename, 'w', encoding='utf-8') as f:
-                            f.write(clean_data)
-                        
-                        # Count reports
-                        if report_type == 'TAF':
-                            lines = clean_data.strip().split('\n')
-                            report_count = len([l for l in lines if l.strip() and 'TAF' in l])
-                        else:
-                            lines = clean_data.strip().split('\n')
-                            report_count = len([l for l in lines if l.strip()])
-                        
-                        results.append({
-                            'month': month,
-                            'month_name': month_name,
-                            'filename': filename,
-                            'reports': report_count,
-                            'success': True
-                        })
-                        
-                        print(f"✅ {report_count} reports saved")
-                    else:
-                        results.append({
-                            'month': month,
-                            'month_name': month_name,
-                            'filename': '',
-                            'reports': 0,
-                            'success': False,
-                            'error': f'No {report_type} data'
-                        })
-                        print("❌ No data found")
-                        
-                except Exception as e:
-                    results.append({
-                        'month': month,
-                        'month_name': month_name,
-                        'filename': '',
-                        'reports': 0,
-                        'success': False,
-                        'error': str(e)
-                    })
-                    print(f"❌ Error: {str(e)[:50]}...")
-                
-                # Increased delay between months to avoid skipping
-                print(f"    Waiting 3 seconds...")
-                time.sleep(3)
-            
-            # Longer delay between batches
-            if batch_idx < len(batches) - 1:
-                wait_time = 7  # Increased from 5 to 7 seconds
-                print(f"\n    ⏳ Waiting {wait_time} seconds before next batch...")
-                time.sleep(wait_time)
+        print(f"Bulk {report_type} download: {','.join(stations)} {start_year}-{end_year}")
         
-        print(f"\n🎉 Batch download completed!")
-        print(f"   ✅ Successful: {sum(1 for r in results if r['success'])}/12 months")
-        print(f"   📊 Total reports: {sum(r['reports'] for r in results if r['success']):,}")
+        job = jobs.submit(BulkJob(stations, str(start_year), str(end_year), report_type))
         
-        return {
-            'station': station,
-            'year': year,
-            'report_type': report_type,
-            'folder': folder_name,
-            'results': results,
-            'total_success': sum(1 for r in results if r['success']),
-            'total_reports': sum(r['reports'] for r in results if r['success'])
-        }
+        self.send_response(303)
+        self.send_header('Location', f"/job/{job.id}")
+        self.send_header('X-Job-Id', job.id)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
 
-    def get_weather_data_with_retry(self, station, year, month, report_type='METAR', end_day=None, retries=3):
-        """Get data with retry logic"""
-        for attempt in range(retries):
-            try:
-                print(f"    Attempt {attempt + 1}/{retries}...", end="")
-                clean_data, raw_data = self.get_weather_data(station, year, month, report_type, end_day)
-                
-                if clean_data and len(clean_data.strip()) > 0:
-                    print("✅ Success")
-                    return clean_data, raw_data
-                else:
-                    print("❌ No data")
-                    if attempt < retries - 1:
-                        print(f"    Waiting 4 seconds before retry...")
-                        time.sleep(4)
-            
-            except requests.exceptions.Timeout:
-                print(f"⌛ Timeout")
-                if attempt < retries - 1:
-                    print(f"    Retrying in 8 seconds...")
-                    time.sleep(8)
-            
-            except requests.exceptions.ConnectionError:
-                print(f"🔌 Connection error")
-                if attempt < retries - 1:
-                    print(f"    Retrying in 10 seconds...")
-                    time.sleep(10)
-            
-            except Exception as e:
-                print(f"⚠️ Error: {str(e)[:30]}")
-                if attempt < retries - 1:
-                    print(f"    Retrying in 5 seconds...")
-                    time.sleep(5)
-        
-        return "", "All retries failed"
+    def process_metrics_request(self):
+        """Prometheus text exposition of the counters, histograms and current state"""
+        with jobs.lock:
+            job_states = [job.status for job in jobs.jobs.values()]
+        gauges = [
+            ('ogimet_jobs', 'Jobs known to the server by status',
+             [({'status': status}, job_states.count(status)) for status in ('queued', 'running', 'done', 'failed')]),
+            ('ogimet_upstream_rate', 'Current upstream request rate allowed by the limiter (req/s)',
+             [({}, rate_limiter.rate)]),
+            ('ogimet_circuit_open', '1 while the upstream circuit breaker is open or half-open',
+             [({}, 0 if breaker.state == 'closed' else 1)]),
+            ('ogimet_retry_budget_tokens', 'Retries currently available in the shared retry budget',
+             [({}, round(retry_budget.tokens, 3))]),
+        ]
+        caches = [(name, cache.stats()) for name, cache in
+                  (('clean', clean_cache), ('page', page_cache), ('index', index_cache))]
+        gauges.append(('ogimet_cache_bytes', 'Bytes held by each in-memory cache',
+                       [({'cache': name}, stats['bytes']) for name, stats in caches]))
+        # Hits and misses only ever go up, so they are counters rate() can work on
+        totals = [
+            ('ogimet_cache_hits_total', 'Hits of each in-memory cache',
+             [({'cache': name}, stats['hits']) for name, stats in caches]),
+            ('ogimet_cache_misses_total', 'Misses of each in-memory cache',
+             [({'cache': name}, stats['misses']) for name, stats in caches]),
+        ]
+        body = metrics.render(gauges, totals).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-    def get_weather_data(self, station, year, month, report_type='METAR', end_day=None):
-        """Get METAR or TAF data with original cleaning"""
-        if not end_day:
-            month_days = {
-                '01': '31', '02': '28', '03': '31', '04': '30',
-                '05': '31', '06': '30', '07': '31', '08': '31',
-                '09': '30', '10': '31', '11': '30', '12': '31'
-            }
-            
-            if month == '02' and int(year) % 4 == 0:
-                end_day = '29'
-            else:
-                end_day = month_days.get(month, '31')
-        
-        # Create session with longer timeout
-        session = requests.Session()
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        }
-        
+    def process_query_request(self):
+        """Reports of one station between two timestamps, as text or JSON
+
+        /query?station=VOGA&type=METAR&start=202402281200&end=202403031200
+        start/end take YYYYMMDDHHMM, YYYY-MM-DDTHH:MM or YYYY-MM-DD (UTC);
+        hours=N instead asks for the last N hours. format=json for JSON.
+        """
+        query = self.path.split('?')[1] if '?' in self.path else ''
+        params = urllib.parse.parse_qs(query)
+        station = params.get('station', ['VOGA'])[0].upper()
+        report_type = params.get('type', ['METAR'])[0].upper()
         try:
-            # Get cookies with longer timeout
-            session.get('https://www.ogimet.com/display_metars2.php?lang=en', 
-                       headers=headers, timeout=30)
-            time.sleep(1)  # Increased from 0.5
-        except:
-            pass
-        
-        # Set report type (METAR=SA, TAF=FC)
-        tipo = 'FC' if report_type == 'TAF' else 'SA'
-        
-        # Form data
-        form_data = {
-            'lugar': station,
-            'tipo': tipo,
-            'ord': 'DIR',
-            'nil': 'NO',
-            'fmt': 'txt',
-            'ano': year,
-            'mes': month,
-            'day': '01',
-            'hora': '00',
-            'min': '00',
-            'anof': year,
-            'mesf': month,
-            'dayf': end_day,
-            'horaf': '23',
-            'minf': '59',
-            'send': 'send',
-            'enviar': 'Send',
-            'lang': 'en'
-        }
-        
-        post_headers = headers.copy()
-        post_headers.update({
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Referer': 'https://www.ogimet.com/display_metars2.php?lang=en',
-        })
+            check_target(station, report_type)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
         
+        now = datetime.utcnow().replace(second=0, microsecond=0)
         try:
-            response = session.post(
-                'https://www.ogimet.com/display_metars2.php',
-                data=form_data,
-                headers=post_headers,
-                timeout=90  # Increased timeout
-            )
-            
-            raw_data = response.text
-            
-            # Debug: Save raw response
-            with open(f"debug_{report_type}_{station}_{year}{month}.html", "w", encoding="utf-8") as f:
-                f.write(raw_data)
-            
-            # Apply cleaning based on report type
-            if report_type == 'TAF':
-                clean_data = self.clean_taf_text_original(raw_data)
+            if 'hours' in params:
+                end = now
+                start = end - timedelta(hours=float(params['hours'][0]))
             else:
-                clean_data = self.clean_metar_text_original(raw_data)
-            
-            # Debug: Save cleaned response
-            with open(f"debug_clean_{report_type}_{station}_{year}{month}.txt", "w", encoding="utf-8") as f:
-                f.write(clean_data)
-            
-            return clean_data, raw_data
-            
-        except Exception as e:
-            print(f"  Request error: {e}")
-            return "", f"Request error: {e}"
-
-    def clean_metar_text_original(self, text):
-        """ORIGINAL METAR cleaning - remove timestamps"""
-        lines = text.split('\n')
-        clean_reports = []
-        
-        for line in lines:
-            line = line.strip()
-            
-            if not line:
-                continue
-            
-            # Skip HTML/comments
-            if line.startswith(('<', '#', '<!--')):
-                continue
-            
-            # Only process METAR/SPECI lines
-            if 'METAR' in line or 'SPECI' in line:
-                # Remove timestamps - KEY FEATURE!
-                if re.match(r'^\d{10,14}\s+', line):
-                    line = re.sub(r'^\d{10,14}\s+', '', line)
-                elif '->' in line:
-                    line = line.split('->', 1)[1].strip()
-                
-                line = ' '.join(line.split())
-                
-                # Validate it's a proper METAR
-                if len(line) > 20 and re.search(r'\d{6}Z', line):
-                    clean_reports.append(line)
+                start = self.parse_timestamp(params['start'][0])
+                end = self.parse_timestamp(params['end'][0]) if 'end' in params else now
+            # Cache paths are only built for years check_target accepts
+            check_target(station, report_type, f"{start.year:04d}")
+        except (KeyError, ValueError, OverflowError) as e:
+            self.send_error(400, f"Bad time range: {e}")
+            return
+        end = min(end, now)
+        span = (end.year - start.year) * 12 + end.month - start.month + 1
+        if start >= end or span > QUERY_MAX_MONTHS:
+            self.send_error(400, f"Time range must be non-empty and at most {QUERY_MAX_MONTHS} months")
+            return
         
-        # Sort by time
-        def get_time(report):
-            match = re.search(r'(\d{6})Z', report)
-            return match.group(1) if match else '000000'
+        print(f"{report_type} query: {station} {start:%Y-%m-%d %H:%M} .. {end:%Y-%m-%d %H:%M}")
         
-        clean_reports.sort(key=get_time)
-        
-        return '\n'.join(clean_reports)
+        reports = self.query_reports(station, report_type, start, end)
+        if params.get('format', ['text'])[0] == 'json':
+            body = json.dumps({
+                'station': station,
+                'type': report_type,
+                'start': start.strftime('%Y-%m-%dT%H:%MZ'),
+                'end': end.strftime('%Y-%m-%dT%H:%MZ'),
+                'count': len(reports),
+                'reports': reports,
+            }).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            body = '\n'.join(reports).encode('utf-8')
+            content_type = 'text/plain; charset=utf-8'
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        self.send_header('X-Report-Count', str(len(reports)))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-    def clean_taf_text_original(self, text):
-        """ORIGINAL TAF cleaning"""
-        lines = text.split('\n')
-        clean_tafs = []
-        current_taf = []
-        in_taf = False
-        
-        for line in lines:
-            line = line.rstrip()  # Only remove trailing spaces
-            
-            if not line:
-                continue
-            
-            # Skip HTML/comments
-            if line.startswith(('<', '#', '<!--')):
-                continue
-            
-            # Check if this is a TAF line (timestamp followed by TAF)
-            if re.match(r'^\d{12}\s+(TAF|TAF\s+AMD|TAF\s+COR)', line):
-                # Save previous TAF if exists
-                if current_taf:
-                    clean_taf = self.process_taf_lines(current_taf)
-                    if clean_taf:
-                        clean_tafs.append(clean_taf)
-                    current_taf = []
-                
-                # Start new TAF - REMOVE leading timestamp
-                clean_line = re.sub(r'^\d{12}\s+', '', line)
-                current_taf.append(clean_line)
-                in_taf = True
-            
-            # If we're in a TAF and line continues it
-            elif in_taf and (line.startswith(' ') or line.startswith('\t') or 
-                            line.startswith('BECMG') or line.startswith('TEMPO') or 
-                            line.startswith('FM') or line.startswith('PROB')):
-                # Check if this is a continuation of current TAF
-                current_taf.append(line.strip())
-            
-            # If line doesn't continue TAF
-            elif in_taf and not (line.startswith(' ') or line.startswith('\t')):
-                # End current TAF
-                if current_taf:
-                    clean_taf = self.process_taf_lines(current_taf)
-                    if clean_taf:
-                        clean_tafs.append(clean_taf)
-                    current_taf = []
-                in_taf = False
-        
-        # Add last TAF if exists
-        if current_taf:
-            clean_taf = self.process_taf_lines(current_taf)
-            if clean_taf:
-                clean_tafs.append(clean_taf)
-        
-        # Sort by time (extract from TAF line)
-        def get_taf_time(taf):
-            first_line = taf.split('\n')[0]
-            match = re.search(r'(\d{6})Z', first_line)
-            return match.group(1) if match else '000000'
+    def parse_timestamp(self, value):
+        for fmt in ('%Y%m%d%H%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+            try:
+                return datetime.strptime(value.rstrip('Z'), fmt)
+            except ValueError:
+                pass
+        raise ValueError(f"unrecognized timestamp {value!r}")
+
+    def process_decoded_request(self):
+        """Serve decoded METAR fields column-wise as JSON, for a month or a whole year"""
+        query = self.path.split('?')[1] if '?' in self.path else ''
+        params = urllib.parse.parse_qs(query)
+        station = params.get('station', ['VOGA'])[0].upper()
+        year = params.get('year', ['2024'])[0]
+        month = params.get('month', [''])[0]
+        try:
+            check_target(station, 'METAR', year, month or None)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
         
-        clean_tafs.sort(key=get_taf_time)
+        print(f"Decoded METAR: {station} {year}{'-' + month if month else ''}")
         
-        return '\n'.join(clean_tafs)
-
-    def process_taf_lines(self, taf_lines):
-        """Process and clean TAF lines"""
-        if not taf_lines:
-            return ""
+        table = self.decode_month(station, year, month) if month else self.decode_year(station, year)
+        body = json.dumps({
+            'station': station,
+            'year': year,
+            'month': month,
+            'count': len(table),
+            'missing': MetarTable.MISSING,
+            'variable': MetarTable.VARIABLE,
+            'columns': table.to_json(),
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def process_job_request(self):
+        """Serve job progress as JSON (/job/<id>/status) or HTML (/job/<id>)"""
+        parts = self.path.split('?')[0].strip('/').split('/')
+        job = jobs.get(parts[1]) if len(parts) > 1 else None
+        if not job:
+            self.send_error(404, "Job not found")
+            return
         
-        # Join lines with single space
-        clean_taf = ' '.join(taf_lines)
+        if len(parts) > 2 and parts[2] == 'events':
+            self.stream_job_events(job)
+            return
         
-        # Remove extra spaces
-        clean_taf = re.sub(r'\s+', ' ', clean_taf)
+        if len(parts) > 2 and parts[2] == 'status':
+            body = json.dumps(job.snapshot()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Cache-Control', 'no-store')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
         
-        # Ensure proper format
-        if 'TAF' in clean_taf and re.search(r'\d{6}Z', clean_taf):
-            return clean_taf
-        return ""
+        page = 'bulk' if job.kind == 'bulk' else 'batch' if job.status == 'done' else 'status'
+        with metrics.timer('ogimet_render_seconds', page=page):
+            if job.kind == 'bulk':
+                html = self.create_bulk_job_page(job.snapshot())
+            elif job.status == 'done':
+                html = self.create_batch_result_page(job.result, job.station, job.year, job.report_type)
+            else:
+                html = self.create_job_status_page(job.snapshot())
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.end_headers()
+        self.wfile.write(html.encode('utf-8'))
 
     def create_single_result_page(self, result, station, year, month, report_type):
         """Create result page for single month"""
@@ -1421,7 +3865,7 @@ class MetarHandler(http.server.SimpleHTTPRequestHandler):
                 <div class="note-box">
                     <strong>{note_text}</strong><br>
                     Files saved with original naming: {report_type}YYYYMM.txt<br>
-                    Downloaded in batches of 2 months with delays.<br>
+                    Upstream requests paced by a shared, adaptive rate limiter.<br>
                     Each month retried up to 3 times if failed.<br>
                     Report type: {'TAF (tipo=FC)' if report_type == 'TAF' else 'METAR (tipo=SA)'}
                 </div>
@@ -1441,54 +3885,465 @@ class MetarHandler(http.server.SimpleHTTPRequestHandler):
         
         return html
 
+    def create_job_status_page(self, job):
+        """Create progress page for a running batch job"""
+        report_type = job['report_type']
+        refresh = '' if job['status'] == 'failed' else '<meta http-equiv="refresh" content="3">'
+        html = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            {refresh}
+            <title>Batch Download In Progress</title>
+            <style>
+                * {{
+                    margin: 0;
+                    padding: 0;
+                    box-sizing: border-box;
+                }}
+                body {{
+                    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                    min-height: 100vh;
+                    padding: 20px;
+                }}
+                .result-card {{
+                    background: rgba(255, 255, 255, 0.95);
+                    border-radius: 20px;
+                    padding: 40px;
+                    max-width: 85%;
+                    margin: 0 auto;
+                    box-shadow: 0 20px 60px rgba(0,0,0,0.3);
+                }}
+                .header {{
+                    text-align: center;
+                    margin-bottom: 40px;
+                }}
+                .header h1 {{
+                    font-size: 2.5rem;
+                    color: #333;
+                    margin-bottom: 10px;
+                }}
+                .month-grid {{
+                    display: grid;
+                    grid-template-columns: repeat(3, 1fr);
+                    gap: 15px;
+                    margin: 40px 0;
+                }}
+                .month-card {{
+                    background: white;
+                    padding: 20px;
+                    border-radius: 12px;
+                    border: 2px solid #e0e0e0;
+                    text-align: center;
+                }}
+                .month-running {{
+                    border-color: #667eea;
+                    background: #eef0fd;
+                }}
+                .month-done {{
+                    border-color: #10b981;
+                    background: #f0f9f4;
+                }}
+                .month-failed {{
+                    border-color: #ef4444;
+                    background: #fef2f2;
+                }}
+                .month-name {{
+                    font-weight: bold;
+                    margin-bottom: 10px;
+                }}
+                .note-box {{
+                    background: #fff3cd;
+                    border: 1px solid #ffc107;
+                    padding: 15px;
+                    border-radius: 10px;
+                    margin-top: 20px;
+                    color: #856404;
+                }}
+            </style>
+        </head>
+        <body>
+            <div class="result-card">
+                <div class="header">
+                    <h1>⏳ {report_type} Batch Download {'Failed' if job['status'] == 'failed' else 'In Progress'}</h1>
+                    <p>{job['station']} - {job['year']} | Job {job['id']}</p>
+                    <p>✅ {job['done']} done | ❌ {job['failed']} failed | 📊 {job['total_reports']:,} reports</p>
+                </div>
+                <div class="month-grid">
+        """
+        
+        status_icons = {'pending': '⏸️', 'running': '⏳', 'done': '✅', 'failed': '❌'}
+        for month in job['months']:
+            html += f"""
+                    <div class="month-card month-{month['status']}">
+                        <div class="month-name">{month['month_name']}</div>
+                        <div>{status_icons.get(month['status'], '')} {month['reports'] if month['status'] == 'done' else month['status']}</div>
+                    </div>
+            """
+        
+        html += f"""
+                </div>
+                <div class="note-box">
+                    {job['error'] or 'This page refreshes every 3 seconds. You can close it - the download keeps running.'}<br>
+                    Bookmark <a href="/job/{job['id']}">/job/{job['id']}</a> to come back to the results.
+                </div>
+            </div>
+        </body>
+        </html>
+        """
+        return html
+
+    def create_bulk_job_page(self, job):
+        """Create progress/result page for a multi-station bulk job"""
+        report_type = job['report_type']
+        finished = job['status'] in ('done', 'failed')
+        refresh = '' if finished else '<meta http-equiv="refresh" content="5">'
+        if job['status'] == 'done':
+            title = f"📦 {report_type} Bulk Download Complete"
+        elif job['status'] == 'failed':
+            title = f"❌ {report_type} Bulk Download Failed"
+        else:
+            title = f"⏳ {report_type} Bulk Download In Progress"
+        html = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            {refresh}
+            <title>Bulk Download</title>
+            <style>
+                * {{
+                    margin: 0;
+                    padding: 0;
+                    box-sizing: border-box;
+                }}
+                body {{
+                    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                    min-height: 100vh;
+                    padding: 20px;
+                }}
+                .result-card {{
+                    background: rgba(255, 255, 255, 0.95);
+                    border-radius: 20px;
+                    padding: 40px;
+                    max-width: 85%;
+                    margin: 0 auto;
+                    box-shadow: 0 20px 60px rgba(0,0,0,0.3);
+                }}
+                .header {{
+                    text-align: center;
+                    margin-bottom: 40px;
+                }}
+                .header h1 {{
+                    font-size: 2.5rem;
+                    color: #333;
+                    margin-bottom: 10px;
+                }}
+                .station-grid {{
+                    display: grid;
+                    grid-template-columns: repeat(4, 1fr);
+                    gap: 15px;
+                    margin: 40px 0;
+                }}
+                .station-card {{
+                    background: white;
+                    padding: 20px;
+                    border-radius: 12px;
+                    border: 2px solid #e0e0e0;
+                    text-align: center;
+                }}
+                .station-code {{
+                    font-size: 1.5rem;
+                    font-weight: bold;
+                    color: #667eea;
+                    margin-bottom: 10px;
+                }}
+                .action-buttons {{
+                    display: flex;
+                    gap: 20px;
+                    margin-top: 40px;
+                }}
+                .action-btn {{
+                    flex: 1;
+                    padding: 20px;
+                    border-radius: 12px;
+                    font-size: 1.2rem;
+                    font-weight: 600;
+                    text-decoration: none;
+                    text-align: center;
+                }}
+                .download-btn {{
+                    background: linear-gradient(90deg, #10b981, #059669);
+                    color: white;
+                }}
+                .back-btn {{
+                    background: #f8f9fa;
+                    color: #555;
+                    border: 2px solid #e0e0e0;
+                }}
+            </style>
+        </head>
+        <body>
+            <div class="result-card">
+                <div class="header">
+                    <h1>{title}</h1>
+                    <p>{len(job['stations'])} stations | {job['start_year']}-{job['end_year']} | Job {job['id']}</p>
+                    <p>✅ {job['done']} done | ❌ {job['failed']} failed | {job['done'] + job['failed']}/{job['total']} months | 📊 {job['total_reports']:,} reports</p>
+                </div>
+                <div class="station-grid">
+        """
+        
+        for station in job['stations']:
+            html += f"""
+                    <div class="station-card">
+                        <div class="station-code">{station['station']}</div>
+                        <div>✅ {station['done']} ❌ {station['failed']} / {station['total']}</div>
+                        <div style="font-size: 0.9rem; color: #666;">{station['reports']:,} reports</div>
+                    </div>
+            """
+        
+        html += """
+                </div>
+                <div class="action-buttons">
+        """
+        if job['status'] == 'done':
+            html += f"""
+                    <a href="/file/{job['folder']}" class="action-btn download-btn">
+                        📥 Download All {report_type} Files (Zip)
+                    </a>
+            """
+        html += f"""
+                    <a href="/" class="action-btn back-btn">
+                        ← New Download
+                    </a>
+                </div>
+                <p style="margin-top: 20px; color: #666;">{job['error']}</p>
+            </div>
+        </body>
+        </html>
+        """
+        return html
+
+    def send_folder_zip(self, path):
+        """Stream a zip of the folder's .txt files, reusing a cached archive if unchanged
+
+        The archive is written to the socket entry by entry (no Content-Length),
+        so memory stays bounded whatever the folder size. A copy is kept in
+        ZIP_CACHE_DIR keyed by the folder's file list, sizes and mtimes.
+        """
+        files = []
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                if name.endswith('.txt'):
+                    file_path = os.path.join(root, name)
+                    files.append((file_path, os.path.relpath(file_path, os.path.dirname(path))))
+        
+        fingerprint = hashlib.sha1(repr([
+            (arcname, os.stat(file_path).st_size, os.stat(file_path).st_mtime_ns)
+            for file_path, arcname in files
+        ]).encode('utf-8')).hexdigest()[:16]
+        prefix = f"{os.path.basename(path)}-{hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:8]}"
+        cache_path = os.path.join(ZIP_CACHE_DIR, f"{prefix}-{fingerprint}.zip")
+        
+        if os.path.exists(cache_path):
+            # Same files as last time - no compression, and ranges/validators work
+            self.send_static_file(cache_path, 'application/zip', f"{os.path.basename(path)}.zip")
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-type', 'application/zip')
+        self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(path)}.zip"')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        
+        os.makedirs(ZIP_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        committed = False
+        try:
+            with open(tmp_path, 'wb') as cache_file:
+                with zipfile.ZipFile(TeeWriter(self.wfile, cache_file), 'w', zipfile.ZIP_DEFLATED) as zipf:
+                    for file_path, arcname in files:
+                        zipf.write(file_path, arcname)
+            os.replace(tmp_path, cache_path)
+            committed = True
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        finally:
+            # Whatever went wrong (timeouts, aborted sockets, files vanishing), no stray .tmp is left
+            if not committed:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+        
+        # Drop archives of earlier versions of this folder
+        for name in os.listdir(ZIP_CACHE_DIR):
+            if name.startswith(f"{prefix}-") and name.endswith('.zip') and name != os.path.basename(cache_path):
+                try:
+                    os.remove(os.path.join(ZIP_CACHE_DIR, name))
+                except OSError:
+                    pass
+
     def send_file(self):
         """Serve file or folder for download"""
         path = self.path[6:]  # Remove '/file/'
         
         if os.path.isdir(path):
-            # Create zip of folder
-            import zipfile
-            import io
-            
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(path):
-                    for file in files:
-                        if file.endswith('.txt'):
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.relpath(file_path, os.path.dirname(path))
-                            zipf.write(file_path, arcname)
-            
-            zip_buffer.seek(0)
-            self.send_response(200)
-            self.send_header('Content-type', 'application/zip')
-            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(path)}.zip"')
-            self.send_header('Content-Length', str(zip_buffer.getbuffer().nbytes))
-            self.end_headers()
-            self.wfile.write(zip_buffer.getvalue())
+            self.send_folder_zip(path)
             
         elif os.path.exists(path):
             # Serve single file
-            self.send_response(200)
-            self.send_header('Content-type', 'text/plain; charset=utf-8')
-            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(path)}"')
-            
-            with open(path, 'rb') as f:
-                file_content = f.read()
-            
-            self.send_header('Content-Length', str(len(file_content)))
-            self.end_headers()
-            self.wfile.write(file_content)
+            self.send_static_file(path, 'text/plain; charset=utf-8', os.path.basename(path))
         else:
             self.send_error(404, "File not found")
 
+    def send_static_file(self, path, content_type, filename):
+        """Send a file with ETag/Last-Modified validators and single byte-range support
+
+        The body goes out with socket.sendfile(), which uses the kernel's
+        zero-copy sendfile where the platform has it.
+        """
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        
+        if self.not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+            return
+        
+        start, end = 0, size - 1
+        partial = False
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_header and size and (not if_range or if_range in (etag, last_modified)):
+            byte_range = self.parse_byte_range(range_header, size)
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start, end = byte_range
+            partial = True
+        
+        self.send_response(206 if partial else 200)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        if partial:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1 if size else 0))
+        self.end_headers()
+        
+        if size:
+            self.wfile.flush()
+            with open(path, 'rb') as f:
+                self.connection.sendfile(f, start, end - start + 1)
+
+    def not_modified(self, etag, mtime):
+        """Conditional GET check - If-None-Match wins over If-Modified-Since"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f"W/{etag}" in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since
+        return False
+
+    def parse_byte_range(self, header, size):
+        """(start, end) for a single 'bytes=' range, or None if unsatisfiable"""
+        match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', header)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size or end < start:
+            return None
+        return start, end
+
+class TeeWriter:
+    """Write-only file object that copies everything to several outputs"""
+    def __init__(self, *outputs):
+        self.outputs = outputs
+
+    def write(self, data):
+        for output in self.outputs:
+            output.write(data)
+        return len(data)
+
+    def flush(self):
+        for output in self.outputs:
+            output.flush()
+
+
+class PooledHTTPServer(socketserver.TCPServer):
+    """TCP server that serves each connection from a bounded worker pool"""
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS, max_queue=MAX_QUEUE):
+        super().__init__(server_address, handler_class)
+        self.max_workers = max_workers
+        self.pool = DaemonThreadPool(max_workers=max_workers, thread_name_prefix='metar-worker')
+        # One slot per running or waiting request - beyond that we reject
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            # Pool and queue are full - fail fast instead of piling up
+            try:
+                request.sendall(b"HTTP/1.0 503 Service Unavailable\r\n"
+                                b"Retry-After: 5\r\n"
+                                b"Content-Length: 0\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self.pool.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
 # Start server
 if __name__ == "__main__":
     try:
-        with socketserver.TCPServer(("", PORT), MetarHandler) as httpd:
+        with PooledHTTPServer(("", PORT), MetarHandler) as httpd:
             print(f"🌐 Server started on port {PORT}")
+            print(f"🧵 Workers: {MAX_WORKERS} (queue: {MAX_QUEUE})")
             print(f"📡 Access at: http://localhost:{PORT}")
             print("🛑 Press Ctrl+C to stop the server")
+            prefetcher.start()
             httpd.serve_forever()
     except KeyboardInterrupt:
         print("\n🛑 Server stopped.")